@@ -0,0 +1,157 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import irradianceSource
+from defaults import make_panel, make_load   # Same panel and load as sim.py
+from solarData import process_solar_data, get_irr_at_time
+from simulation import stress_test
+
+
+def measure(name, run, steps, simulatedSeconds=None, repeat=3, setup=None):
+  """
+  Times one benchmark case.
+
+  Args:
+      name: Label for the results.
+      run: Function to time.  Called with whatever setup() returns, or with nothing.
+      steps: How many calls / simulation steps / rows one run() covers.
+      simulatedSeconds: Simulated time one run() covers, for the simulation cases.
+      repeat: Number of timed runs; the fastest one is reported.
+      setup: Optional function run (untimed) before every run(), e.g. to build a fresh load.
+
+  Returns:
+      A dict of results: wall time, steps per second, simulated seconds per wall second and peak
+      traced memory (measured in a separate run, since tracing slows everything down).
+  """
+
+  def once():
+    args = () if setup is None else (setup(),)
+    with contextlib.redirect_stdout(io.StringIO()):   # stress_test prints
+      start = time.perf_counter()
+      run(*args)
+      return time.perf_counter() - start
+
+  once()   # warm up caches and imports
+  wall = min(once() for i in range(repeat))
+
+  tracemalloc.start()
+  once()
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+
+  result = {'name': name, 'wallSeconds': wall, 'steps': steps, 'stepsPerSecond': steps / wall, 'peakMemoryBytes': peak}
+  if simulatedSeconds is not None:
+    result['simulatedSeconds'] = simulatedSeconds
+    result['simulatedSecondsPerWallSecond'] = simulatedSeconds / wall
+  print("%-55s %10.4f s  %14.0f steps/s  %10.1f MB peak" % (name, wall, result['stepsPerSecond'], peak / 2**20), file=sys.stderr)
+  return result
+
+
+def core_benchmarks(calls, repeat):
+  solarPanel = make_panel()
+  voltages = np.random.default_rng(0).uniform(0, solarPanel.Voc, calls).tolist()
+  results = []
+
+  def panel_output():
+    for v in voltages: solarPanel.panel_output(v, 800)
+  results.append(measure("panel.panel_output", panel_output, calls, repeat=repeat))
+
+  def get_irradiance():
+    for v in voltages: solarPanel.get_irradiance(100.0, v)
+  results.append(measure("panel.get_irradiance", get_irradiance, calls, repeat=repeat))
+
+  array = np.array(voltages)
+  results.append(measure("panel.panel_output_array", lambda: solarPanel.panel_output_array(array, 800), calls, repeat=repeat))
+
+  def get_power(load):
+    v = solarPanel.Vmp
+    for k in range(calls):
+      v = v + (0.01 if k % 2 else -0.01)
+      load.get_power(v, 0.1, solarPanel)
+  results.append(measure("dynamicLoad.get_power", get_power, calls, repeat=repeat, setup=lambda: make_load(solarPanel)))
+  return results
+
+
+def stress_benchmarks(dts, segmentTime, repeat):
+  solarPanel = make_panel()
+  results = []
+  for dt in dts:
+    steps = len(np.arange(0, 3 * segmentTime, dt)) - 1
+    results.append(measure("stress_test dt=%g" % dt, lambda load, dt=dt: stress_test(solarPanel, load, dt, 1000, 0, segmentTime),
+                           steps, simulatedSeconds=3 * segmentTime, repeat=repeat, setup=lambda: make_load(solarPanel)))
+  return results
+
+
+def data_benchmarks(files, queries, repeat):
+  results = []
+  for file_path in files:
+    rows = sum(1 for line in open(file_path)) - 1
+    name = os.path.basename(file_path)
+    results.append(measure("process_solar_data " + name, lambda: process_solar_data(file_path), rows, repeat=repeat))
+
+    df = process_solar_data(file_path)
+    times = np.random.default_rng(1).uniform(0, df["time_delta_seconds"].max(), queries).tolist()
+    results.append(measure("get_irr_at_time " + name, lambda: [get_irr_at_time(df, t) for t in times], queries, repeat=repeat))
+
+    source = irradianceSource.irradianceSource(df)
+    ordered = sorted(times)
+    results.append(measure("irradianceSource.irr_at " + name, lambda: [source.irr_at(t) for t in ordered], queries, repeat=repeat))
+  return results
+
+
+def environment():
+  try:
+    commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+  except OSError:
+    commit = ""
+  return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+          'machine': platform.machine(), 'processor': platform.processor(), 'cpus': os.cpu_count(),
+          'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+
+def run_benchmarks(calls=100000, dts=(1.0, 0.1, 0.01), segmentTime=15, files=None, queries=200, repeat=3):
+  """
+  Runs the whole suite without touching the Dash app.
+
+  Returns:
+      A dict with 'environment' (commit, versions, machine) and 'results' (one dict per case, see measure()).
+  """
+
+  if files is None:
+    dataDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    files = sorted(os.path.join(dataDir, f) for f in os.listdir(dataDir) if f.endswith(".csv"))
+  results = core_benchmarks(calls, repeat) + stress_benchmarks(dts, segmentTime, repeat) + data_benchmarks(files, queries, repeat)
+  return {'environment': environment(), 'results': results}
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark the simulator core and write the results as JSON.")
+  parser.add_argument("-o", "--output", help="JSON file to write (default: print to stdout)")
+  parser.add_argument("--calls", type=int, default=100000, help="calls per run for the per-function cases")
+  parser.add_argument("--dt", type=float, nargs="+", default=[1.0, 0.1, 0.01], help="stress_test step sizes")
+  parser.add_argument("--queries", type=int, default=200, help="lookups per run for the get_irr_at_time cases")
+  parser.add_argument("--repeat", type=int, default=3, help="timed runs per case (fastest is kept)")
+  parser.add_argument("--quick", action="store_true", help="small sizes, for a smoke test")
+  args = parser.parse_args()
+
+  if args.quick:
+    report = run_benchmarks(calls=5000, dts=[1.0, 0.1], queries=20, repeat=1)
+  else:
+    report = run_benchmarks(calls=args.calls, dts=args.dt, queries=args.queries, repeat=args.repeat)
+
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(report, f, indent=2)
+  else:
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,193 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import defaults
+import fleet
+import solarData
+
+
+def find_dips(times, irrs, dipThreshold=0.2, minLevel=50, maxDipSeconds=2 * 3600):
+  """
+  Finds the cloud dips in one irradiance history: a reading that drops more than dipThreshold below the one before
+  it starts a dip, and the dip lasts until the irradiance is back within dipThreshold / 2 of where it started.
+
+  Args:
+      times: Reading times in seconds, sorted.
+      irrs: Irradiance at each reading.
+      dipThreshold: Fractional drop that counts as a cloud edge.
+      minLevel: Readings below this are too dark to start a dip from (night, dawn, dusk).
+      maxDipSeconds: Anything that takes longer than this to recover is weather or sunset, not a cloud, and is left out.
+
+  Returns:
+      A dict of arrays, one entry per dip: depth (fraction of the starting level lost at the bottom), duration
+      (seconds), downRate and upRate (W/m^2 per second on the way down and back up, starting level included).
+  """
+
+  times = np.asarray(times, dtype=float)
+  irrs = np.asarray(irrs, dtype=float)
+  dips = {'depth': [], 'duration': [], 'downRate': [], 'upRate': []}
+  # Only readings that fall hard enough can start a dip, so just walk from each of those
+  candidates = np.flatnonzero((irrs[:-1] >= minLevel) & (irrs[1:] < (1 - dipThreshold) * irrs[:-1]))
+  resume = 0
+  for i in candidates:
+    if i < resume: continue   # Inside the previous dip
+    level = irrs[i]
+    recovered = np.flatnonzero(irrs[i + 1:] >= (1 - dipThreshold / 2) * level)
+    if len(recovered) == 0: break
+    j = i + 1 + recovered[0]
+    resume = j
+    if times[j] - times[i] > maxDipSeconds: continue
+    bottom = i + 1 + int(np.argmin(irrs[i + 1:j]))
+    dips['depth'].append(1 - irrs[bottom] / level)
+    dips['duration'].append(times[j] - times[i])
+    dips['downRate'].append((level - irrs[bottom]) / max(times[bottom] - times[i], 1e-3))
+    dips['upRate'].append((irrs[j] - irrs[bottom]) / max(times[j] - times[bottom], 1e-3))
+  return {key: np.array(value) for key, value in dips.items()}
+
+
+def ramp_statistics(files=None, dipThreshold=0.2, minLevel=50):
+  """
+  Measures how clouds move the irradiance in recorded data, for cloud_traces() to copy.
+  Every sensor in every file is looked at on its own (see solarData.process_solar_entities).
+
+  Args:
+      files: CSV paths.  Defaults to every CSV in data/.
+      dipThreshold: Fractional drop that counts as a cloud edge (see find_dips()).
+      minLevel: Irradiance below this counts as dark.
+
+  Returns:
+      A dict: dipRate (dips per second of daylight), depth/duration/downRate/upRate (one entry per dip found, kept
+      together so a dip's depth and speed stay matched), flicker (standard deviation of the fractional change between
+      readings outside of dips), holdSeconds (typical time between readings) and daylightSeconds.
+  """
+
+  if files is None:
+    dataDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    files = sorted(os.path.join(dataDir, f) for f in os.listdir(dataDir) if f.endswith(".csv"))
+
+  dips = []
+  flicker = []
+  intervals = []
+  daylightSeconds = 0.0
+  for file_path in files:
+    df = solarData.process_solar_entities(file_path)
+    times = df["time_delta_seconds"].to_numpy()
+    for column in df.columns.drop(["last_changed", "time_delta_seconds"]):
+      irrs = df[column].to_numpy(dtype=float)
+      changed = np.append(True, np.diff(irrs) != 0)   # The grid is shared with the other sensors, keep this one's own readings
+      t, x = times[changed], irrs[changed]
+      dips.append(find_dips(t, x, dipThreshold, minLevel))
+      lit = x[:-1] >= minLevel
+      daylightSeconds = daylightSeconds + float(np.sum(np.diff(t)[lit]))
+      change = np.diff(x)[lit] / x[:-1][lit]
+      flicker.append(change[np.abs(change) < dipThreshold])
+      intervals.append(np.diff(t)[lit])
+
+  stats = {key: np.concatenate([d[key] for d in dips]) for key in ('depth', 'duration', 'downRate', 'upRate')}
+  stats['dipRate'] = len(stats['depth']) / daylightSeconds if daylightSeconds > 0 else 0.0
+  stats['flicker'] = float(np.std(np.concatenate(flicker)))
+  stats['holdSeconds'] = float(np.median(np.concatenate(intervals)))
+  stats['daylightSeconds'] = daylightSeconds
+  return stats
+
+
+def cloud_traces(n, duration, dt, stats, baseIrr=1000, dipRateScale=1.0, flickerScale=1.0, seed=None, dtype=np.float64):
+  """
+  Generates n random irradiance traces at once, each a clear sky of baseIrr with clouds passing over it.
+
+  Clouds arrive at the measured dipRate (Poisson, times dipRateScale).  Each one is a real dip from stats, drawn
+  whole: it ramps down at that dip's downRate to that dip's depth, holds, and ramps back up at its upRate, so cloud
+  edges are as sharp as the recorded ones and dips are partial as often as the recorded ones.  Overlapping clouds
+  multiply.  On top of that goes flicker: random fractional noise with the measured spread, held for holdSeconds
+  at a time like the sensor readings.
+
+  Args:
+      n: Number of traces.
+      duration: Length of each trace in seconds.
+      dt: Step length in seconds.
+      stats: From ramp_statistics().
+      baseIrr: Clear-sky irradiance, in W/m^2.  A scalar, or an array of length n.
+      dipRateScale: Multiplies the cloud rate, e.g. 5 for a very broken-cloud day.
+      flickerScale: Multiplies the flicker spread.  0 turns it off.
+      seed: Seed for numpy's random generator, for repeatable traces.
+      dtype: Element type of the result.  float32 halves the memory for big batches.
+
+  Returns:
+      An (n, steps) array, one trace per row, steps = round(duration / dt).  Column j is the irradiance from j*dt.
+  """
+
+  rng = np.random.default_rng(seed)
+  steps = int(round(duration / dt))
+  t = np.arange(steps) * dt
+  base = np.broadcast_to(np.asarray(baseIrr, dtype=float), (n,))[:, None]
+
+  attenuation = np.ones((n, steps), dtype=dtype)
+  clouds = rng.poisson(stats['dipRate'] * dipRateScale * duration, n)
+  for k in range(int(clouds.max()) if n else 0):
+    active = clouds > k
+    pick = rng.integers(len(stats['depth']), size=n)
+    depth = np.where(active, stats['depth'][pick], 0)[:, None]
+    length = stats['duration'][pick][:, None]
+    start = rng.uniform(-length[:, 0], duration)[:, None]   # Can already be under way when the trace starts
+    fall = np.clip(depth * base / stats['downRate'][pick][:, None], 1e-9, length / 2)
+    rise = np.clip(depth * base / stats['upRate'][pick][:, None], 1e-9, length / 2)
+    # Trapezoid: 0 before the cloud, 1 at full depth, 0 after
+    shape = np.clip(np.minimum((t - start) / fall, (start + length - t) / rise), 0, 1)
+    attenuation *= 1 - depth * shape
+
+  irr = attenuation
+  irr *= base
+  if flickerScale and stats['flicker'] > 0:
+    hold = max(1, int(round(stats['holdSeconds'] / dt)))
+    noise = rng.normal(0, stats['flicker'] * flickerScale, (n, -(-steps // hold)))
+    irr *= 1 + np.repeat(noise, hold, axis=1)[:, :steps]
+  np.maximum(irr, 0, out=irr)
+  return irr
+
+
+def brownout_probability(solarPanel, traces, dt, parameterSets=None):
+  """
+  Runs every parameter set against every trace in one fleet.fleet, all stepped together, and counts brownouts.
+
+  Args:
+      solarPanel: The panel behind every unit.
+      traces: (n, steps) irradiance array, e.g. from cloud_traces().  Column j holds from j*dt, so the run takes
+          steps - 1 steps, the last ending at the start of the last column.
+      dt: Step length in seconds.  Should match the traces.
+      parameterSets: List of dicts of dynamicLoad arguments, e.g. sweep.parameter_grid(capacitorSize=[60, 180],
+          pwrScaleDownSpeed=[5, 50]).  Missing arguments come from defaults.defaultLoadParameters; initialPanelVoltage
+          defaults to the panel's Vmp.  Defaults to one set of all defaults.
+
+  Returns:
+      A pandas DataFrame with one row per parameter set: the parameters, then brownoutProbability (fraction of
+      traces with at least one brownout), brownoutProbabilityError (its standard error), meanBrownouts (per trace)
+      and traces.
+  """
+
+  if parameterSets is None: parameterSets = [{}]
+  n, steps = traces.shape
+  settings = []
+  for parameters in parameterSets:
+    s = dict(defaults.defaultLoadParameters)
+    s.update(parameters)
+    s.setdefault('initialPanelVoltage', solarPanel.Vmp)
+    settings.append(s)
+
+  # One unit per (parameter set, trace), parameter sets in blocks of n
+  units = fleet.fleet(solarPanel, n=n * len(settings), **{name: np.repeat([s[name] for s in settings], n) for name in settings[0]})
+  for j in range(1, steps):
+    units.step(np.tile(traces[:, j - 1], len(settings)), dt)   # The step from (j-1)*dt to j*dt, under column j-1's irradiance
+
+  brownouts = units.brownouts.reshape(len(settings), n)
+  rows = []
+  for parameters, counts in zip(parameterSets, brownouts):
+    p = float(np.mean(counts > 0))
+    row = dict(parameters)
+    row['brownoutProbability'] = p
+    row['brownoutProbabilityError'] = float(np.sqrt(p * (1 - p) / n))
+    row['meanBrownouts'] = float(np.mean(counts))
+    row['traces'] = n
+    rows.append(row)
+  return pd.DataFrame(rows)
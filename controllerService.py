@@ -0,0 +1,295 @@
+import argparse
+import asyncio
+import collections
+import json
+import math
+import time
+
+import numpy as np
+
+import defaults
+import irradianceSource
+import simulation
+from solarData import process_solar_data
+
+
+class controllerService:
+    # Runs dynamicLoad.get_power() as a live controller for many loads in one asyncio event loop.
+    # Samples (unit, t, panelVoltage) come in through submit(), from whatever feed: a socket (serve_socket()),
+    # a replayed CSV or a simulated stand-in (plantFeed).  Each sample is run through the same brownout check +
+    # get_power() as the simulations (simulation.load_step), with dt measured from that unit's previous sample
+    # time, and the new power setpoint goes out through publish(unit, t, power).
+    #
+    # Backpressure: each unit has one mailbox slot.  A sample that arrives while the unit's last one is still waiting
+    # replaces it (counted as coalesced), so the backlog never grows past one sample per unit, and the controller
+    # always acts on the freshest voltage, with dt covering the whole gap.
+    # Latency (arrival to setpoint published) and throughput are in metrics().
+
+    vocMargin = 1e-3   # volts.  Samples closer to Voc than this are handled as this far below it
+
+    def __init__(self, solarPanel, loads, publish=None, batchSize=64, latencyWindow=65536):
+        self.solarPanel = solarPanel
+        self.loads = loads                      # {unit: dynamicLoad}, or a list (units are then 0..n-1)
+        if not isinstance(loads, dict):
+            self.loads = dict(enumerate(loads))
+        self.publish = publish                  # called as publish(unit, t, power), must not block.  None just keeps setpoints
+        self.batchSize = batchSize              # samples handled before yielding back to the event loop, so feeds keep flowing
+        self.setpoints = {unit: load.lastPower for unit, load in self.loads.items()}
+        self.lastTime = {}                      # unit -> time of the last sample acted on
+        self.pending = {}                       # unit -> (t, voltage, arrival) waiting to be handled
+        self.order = collections.deque()        # units with a pending sample, oldest first
+        self.wake = asyncio.Event()
+        self.running = False
+        # metrics
+        self.received = 0
+        self.processed = 0
+        self.coalesced = 0
+        self.outOfOrder = 0
+        self.rejected = 0                       # samples with a NaN / infinite time or voltage, dropped
+        self.clampedAtVoc = 0                   # samples at (or within vocMargin of) Voc, handled as vocMargin below it
+        self.errors = 0                         # samples whose handling raised; the unit keeps its last setpoint
+        self.lastError = None                   # (unit, t, message) of the latest of those
+        self.brownouts = 0
+        self.latencies = np.zeros(latencyWindow)   # ring buffer of the latest latencies, seconds
+        self.latencyCount = 0
+        self.maxLatency = 0.0
+        self.started = None
+
+    def submit(self, unit, t, voltage):
+        # Hand in one sample.  Not a coroutine, so feeds can call it straight from a socket callback.
+        self.received = self.received + 1
+        if not (math.isfinite(t) and math.isfinite(voltage)):
+            self.rejected = self.rejected + 1   # Don't let it coalesce over a good sample still waiting
+            return
+        if unit in self.pending:
+            self.coalesced = self.coalesced + 1   # The waiting one is stale now; keep its place in line
+        else:
+            self.order.append(unit)
+        self.pending[unit] = (t, voltage, time.perf_counter())
+        self.wake.set()
+
+    def handle(self, unit, t, voltage, arrival):
+        if not (math.isfinite(t) and math.isfinite(voltage)):
+            # One NaN voltage would stick in the load's lastPanelVoltage and make every later setpoint NaN
+            self.rejected = self.rejected + 1
+            return
+        load = self.loads[unit]
+        if voltage > self.solarPanel.Voc - self.vocMargin:
+            # An unloaded panel really does sit at Voc, but there it makes no current and get_power() can't estimate
+            # the irradiance.  A fixed margin, so a panel parked at Voc reads as steady rather than creeping up on it
+            self.clampedAtVoc = self.clampedAtVoc + 1
+            voltage = self.solarPanel.Voc - self.vocMargin
+        last = self.lastTime.get(unit)
+        if last is None:
+            # First sample: nothing to measure dt against yet, just line the controller up with the real voltage
+            load.lastPanelVoltage = voltage
+            power = load.lastPower
+        elif t <= last:
+            self.outOfOrder = self.outOfOrder + 1
+            return
+        else:
+            voltage, power, brownedOut = simulation.load_step(self.solarPanel, load, voltage, t - last)
+            if brownedOut: self.brownouts = self.brownouts + 1
+        self.lastTime[unit] = t
+        self.setpoints[unit] = power
+        if self.publish is not None:
+            self.publish(unit, t, power)
+
+        latency = time.perf_counter() - arrival
+        self.latencies[self.latencyCount % len(self.latencies)] = latency
+        self.latencyCount = self.latencyCount + 1
+        if latency > self.maxLatency: self.maxLatency = latency
+        self.processed = self.processed + 1
+
+    async def run(self):
+        # The controller task.  Runs until stop() is called.
+        self.running = True
+        self.started = time.perf_counter()
+        while self.running:
+            await self.wake.wait()
+            self.wake.clear()
+            handled = 0
+            while self.order:
+                unit = self.order.popleft()
+                t, voltage, arrival = self.pending.pop(unit)
+                try:
+                    self.handle(unit, t, voltage, arrival)
+                except Exception as e:
+                    # One bad unit mustn't stop the controller for all the others
+                    self.errors = self.errors + 1
+                    self.lastError = (unit, t, repr(e))
+                handled = handled + 1
+                if handled % self.batchSize == 0:
+                    await asyncio.sleep(0)   # Let the feeds in; anything they send for a waiting unit coalesces
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+
+    def metrics(self):
+        elapsed = time.perf_counter() - self.started if self.started is not None else 0.0
+        recent = self.latencies[:min(self.latencyCount, len(self.latencies))]
+        percentile = lambda q: float(np.percentile(recent, q)) * 1000 if len(recent) else None
+        return {'units': len(self.loads), 'received': self.received, 'processed': self.processed, 'coalesced': self.coalesced,
+                'outOfOrder': self.outOfOrder, 'rejected': self.rejected, 'clampedAtVoc': self.clampedAtVoc,
+                'errors': self.errors, 'lastError': self.lastError, 'brownouts': self.brownouts, 'backlog': len(self.order),
+                'elapsedSeconds': elapsed, 'samplesPerSecond': self.processed / elapsed if elapsed > 0 else None,
+                'latencyMsP50': percentile(50), 'latencyMsP99': percentile(99), 'latencyMsMax': self.maxLatency * 1000}
+
+
+class plantFeed:
+    # Local stand-in for the real sensor feed: every unit's panel + capacitor simulated together with numpy, drawing
+    # whatever power the service last told it to, and sampled rate times a (wall clock) second.
+    # Simulated time runs speed times faster than the wall clock, so a recorded day can be replayed in minutes; the
+    # plant itself is stepped at plantDt whatever the speed, so only the controller sees the coarser sample spacing.
+    # irr(t, unit) gives the irradiance, looked up once per sample; see from_csv() for a recorded one.
+
+    def __init__(self, service, irr, rate=10.0, speed=1.0, plantDt=0.1, initialVoltage=None):
+        self.service = service
+        self.irr = irr
+        self.rate = rate
+        self.speed = speed
+        self.plantDt = plantDt
+        self.units = list(service.loads)
+        self.capacitorSize = np.array([service.loads[unit].capacitorSize for unit in self.units], dtype=float)
+        self.voltage = np.array([service.loads[unit].lastPanelVoltage if initialVoltage is None else initialVoltage for unit in self.units], dtype=float)
+        self.ticks = 0
+        self.lateTicks = 0   # ticks that started after the next one was already due
+
+    @classmethod
+    def from_csv(cls, service, file_path, rate=10.0, speed=1.0, start=0.0, plantDt=0.1):
+        # Replays recorded irradiance (same for every unit) from start seconds into the file.  Rows that don't hold a
+        # number ('unavailable') are dropped, so the last good reading holds across them, as with stream_solar_data()
+        df = process_solar_data(file_path, use_cache=True)
+        source = irradianceSource.irradianceSource(df[np.isfinite(df["state"])])
+        return cls(service, lambda t, unit: source.irr_at(source.start + start + t), rate, speed, plantDt)
+
+    def advance(self, t, dt):
+        # Runs the plant from t to t + dt at the current setpoints
+        solarPanel = self.service.solarPanel
+        power = np.array([self.service.setpoints[unit] for unit in self.units], dtype=float)
+        irr = np.array([self.irr(t, unit) for unit in self.units], dtype=float)
+        steps = max(1, int(np.ceil(dt / self.plantDt - 1e-9)))
+        h = dt / steps
+        v = self.voltage
+        for i in range(steps):
+            v = simulation.capacitor_step_array(solarPanel, self.capacitorSize, v, power, irr, h)
+            v = np.maximum(v, 1e-3)   # A real capacitor doesn't go negative; the controller sees the brownout all the same
+        self.voltage = v
+
+    async def run(self, seconds):
+        # Feeds the service for this many wall clock seconds
+        loop = asyncio.get_running_loop()
+        period = 1.0 / self.rate
+        dt = self.speed * period
+        begin = loop.time()
+        while loop.time() - begin < seconds:
+            t = self.ticks * dt
+            if self.ticks: self.advance(t - dt, dt)
+            for unit, v in zip(self.units, self.voltage.tolist()):
+                self.service.submit(unit, t, v)
+            self.ticks = self.ticks + 1
+            wait = begin + self.ticks * period - loop.time()
+            if wait < 0: self.lateTicks = self.lateTicks + 1
+            await asyncio.sleep(max(wait, 0))
+
+
+async def serve_socket(service, host="127.0.0.1", port=8071):
+    """
+    Feeds the service from TCP clients.  Each line a client sends is one sample, "unit,t,voltage" (unit an integer,
+    t in seconds), and every setpoint for a unit goes back to the client that last sent a sample for it as
+    "unit,t,power" (as well as to service.publish, if that was set).  Units the service doesn't supervise and
+    garbled lines are ignored.  Runs until cancelled.
+    """
+
+    writers = {}
+    connections = set()
+    publish = service.publish
+
+    def send(unit, t, power):
+        writer = writers.get(unit)
+        if writer is not None and not writer.is_closing():
+            writer.write(("%d,%r,%r\n" % (unit, t, power)).encode())
+        if publish is not None:
+            publish(unit, t, power)
+    service.publish = send
+
+    async def client(reader, writer):
+        connections.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line: break
+                try:
+                    unit, t, voltage = line.decode().split(",")[:3]
+                    unit = int(unit)
+                    if unit not in service.loads: continue
+                    writers[unit] = writer
+                    service.submit(unit, float(t), float(voltage))
+                except ValueError:
+                    continue   # Garbled line, skip it
+        finally:
+            connections.discard(writer)
+            writer.close()
+
+    server = await asyncio.start_server(client, host, port)
+    async with server:
+        try:
+            await server.serve_forever()
+        finally:
+            for writer in list(connections):
+                writer.close()   # Otherwise shutting the server down waits on every client still connected
+
+
+def default_service(units):
+    # A service supervising units of sim.py's load, all behind sim.py's panel
+    solarPanel = defaults.make_panel()
+    return controllerService(solarPanel, [defaults.make_load(solarPanel) for i in range(units)])
+
+
+async def run_stand_in(units=300, rate=10.0, seconds=10.0, file_path=None, speed=1.0, irr=1000.0):
+    # Closed loop test: one default_service(), fed by a plantFeed
+    service = default_service(units)
+    if file_path is not None:
+        feed = plantFeed.from_csv(service, file_path, rate, speed)
+    else:
+        feed = plantFeed(service, lambda t, unit: irr, rate, speed)
+    controller = asyncio.create_task(service.run())
+    await feed.run(seconds)
+    await asyncio.sleep(0.1)   # Let the last samples through
+    service.stop()
+    await controller
+    report = service.metrics()
+    report['feedTicks'] = feed.ticks
+    report['lateFeedTicks'] = feed.lateTicks
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run dynamicLoad as a live controller for many units and report latency and throughput.")
+    parser.add_argument("--units", type=int, default=300, help="loads to supervise")
+    parser.add_argument("--rate", type=float, default=10.0, help="samples per second per unit")
+    parser.add_argument("--seconds", type=float, default=10.0, help="how long to run (wall clock)")
+    parser.add_argument("--csv", help="replay irradiance from this CSV instead of a constant --irr")
+    parser.add_argument("--speed", type=float, default=1.0, help="simulated seconds per wall clock second")
+    parser.add_argument("--irr", type=float, default=1000.0, help="constant irradiance for the stand-in feed")
+    parser.add_argument("--port", type=int, help="serve samples from TCP clients on this port instead of the stand-in feed")
+    args = parser.parse_args()
+
+    if args.port is not None:
+        service = default_service(args.units)
+
+        async def main():
+            # Serve until interrupted, printing the metrics every --seconds.  Stops (with its traceback) if the
+            # controller or the server dies
+            tasks = {asyncio.create_task(service.run()), asyncio.create_task(serve_socket(service, port=args.port))}
+            while True:
+                done, running = await asyncio.wait(tasks, timeout=args.seconds)
+                print(json.dumps(service.metrics()))
+                for task in done:
+                    task.result()   # Raises whatever ended it
+                if done:
+                    raise RuntimeError("controller or server stopped unexpectedly")
+        asyncio.run(main())
+    else:
+        print(json.dumps(asyncio.run(run_stand_in(args.units, args.rate, args.seconds, args.csv, args.speed, args.irr)), indent=2))
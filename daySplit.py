@@ -0,0 +1,198 @@
+import copy
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import simulation
+
+
+totalKeys = ('simulatedSeconds', 'steps', 'skippedSteps', 'energyHarvested', 'energyMined', 'brownouts', 'curtails', 'timeCurtailed')
+
+
+def find_resets(times, irrs, dt, minDark=4 * 3600, darkIrr=0.0):
+  """
+  Finds the nights in an irradiance history: stretches of at least minDark seconds where the irradiance never rises
+  above darkIrr.  By then the load has long since curtailed and the capacitor has stopped moving, so the night is
+  a natural place to cut a long run into days.
+
+  Args:
+      times: Reading times in seconds, sorted.
+      irrs: Irradiance at each reading.
+      dt: Step length of the run.  Cuts land on its step grid (whole steps from times[0]).
+      minDark: Shortest dark stretch, in seconds, that counts as a night.
+      darkIrr: Readings at or below this count as dark.
+
+  Returns:
+      A list of cut times, one in the middle of each night.
+  """
+
+  dark = np.append(np.asarray(irrs) <= darkIrr, False)
+  edges = np.diff(np.concatenate([[0], dark.astype(np.int8)]))
+  starts = np.flatnonzero(edges == 1)
+  ends = np.flatnonzero(edges == -1)   # Index of the first lit reading after each dark stretch (len(times) for the last)
+  cuts = []
+  for start, end in zip(starts, ends):
+    if end >= len(times): continue   # Dark to the end of the history, nothing after it to split off
+    if times[end] - times[start] >= minDark:
+      middle = (times[start] + times[end]) / 2
+      cuts.append(times[0] + np.floor((middle - times[0]) / dt) * dt)
+  return cuts
+
+
+def add_totals(a, b):
+  return {key: a[key] + b[key] for key in totalKeys}
+
+
+def sub_totals(a, b):
+  return {key: a[key] - b[key] for key in totalKeys}
+
+
+def run_segment(solarPanel, load, times, irrs, dt, start, end, checkpointSteps, skipQuiescent=False, merge=None):
+  """
+  Runs the load from start to end in windows of checkpointSteps steps, noting the load state and running totals
+  after each window.  Top level, so a process pool can pickle it.
+
+  Args:
+      solarPanel: The panel feeding the capacitor.
+      load: The dynamicLoad, already in the state it should start from.  Updated in place.
+      times, irrs: Readings covering the segment, including the last one at or before start.
+      dt: Step length in seconds.
+      start: Time of the first step.
+      end: Steps start before this.
+      checkpointSteps: Steps per window.
+      skipQuiescent: See simulation.run_real_data.
+      merge: Optional checkpoints from an earlier run of the same segment.  The run stops at the first checkpoint
+          where the load state is identical to the earlier run's, since everything after that would be too.
+
+  Returns:
+      (checkpoints, mergedAt): checkpoints is a list of (snapshot, totals so far) after every window, and mergedAt
+      the index of the checkpoint where the run caught up with merge (None if it never did).
+  """
+
+  checkpoints = []
+  totals = dict.fromkeys(totalKeys, 0)
+  i = 0
+  while start + i * checkpointSteps * dt < end:
+    windowStart = start + i * checkpointSteps * dt
+    windowEnd = min(start + ((i + 1) * checkpointSteps - 0.5) * dt, end)
+    first = int(np.searchsorted(times, windowStart, side="right")) - 1
+    last = int(np.searchsorted(times, windowEnd, side="left"))
+    # The reading in force at windowStart, moved up to windowStart, then every reading inside the window
+    chunk = (np.concatenate([[windowStart], times[first + 1:last]]), np.concatenate([[irrs[first]], irrs[first + 1:last]]))
+    totals = add_totals(totals, simulation.run_real_data(solarPanel, load, [chunk], dt, skipQuiescent=skipQuiescent, until=windowEnd))
+    checkpoints.append((simulation.load_snapshot(load), totals))
+    if merge is not None and i < len(merge) and simulation.same_snapshot(checkpoints[-1][0], merge[i][0], 0):
+      return checkpoints, i
+    i = i + 1
+  return checkpoints, None
+
+
+def run_days(solarPanel, load, scenario, dt, processes=None, minDark=4 * 3600, darkIrr=0.0, checkpointSeconds=900,
+             skipQuiescent=False, nightVoltage=None):
+  """
+  simulation.run_real_data for a long history, with the days simulated side by side in worker processes.
+
+  The history is cut in the middle of every night (see find_resets()).  Every day but the first starts from a
+  typical night state (curtailed, no power, capacitor at nightVoltage), since the real one isn't known until the
+  day before has been run.  Then, in order, each cut is checked: the state the day before actually ended in must be
+  exactly the state the next day was started from.  Where it isn't, that day is run again from the right state,
+  but only until it lands in exactly the same state as the first attempt at one of its checkpoints (days forget
+  how they started by the first curtail or brownout), and the rest of the first attempt's totals are kept.
+  These re-runs go side by side too, as a second round.  The stitched totals are the ones a serial run over the
+  same windows gives, and the checked state at every cut is the serial one.
+
+  The windows put every step on the same grid as a single run from the first reading.
+
+  Args:
+      solarPanel: The panel feeding the capacitor.
+      load: The dynamicLoad to run.  Left in its final state, as with run_real_data.
+      scenario: A (times, irradiance) tuple, e.g. sweep.real_data_scenario("data/West_roof.csv").
+      dt: Step length in seconds.
+      processes: Worker processes.  Defaults to every core.  1 runs everything in this process.
+      minDark: Shortest dark stretch, in seconds, that counts as a night.
+      darkIrr: Readings at or below this count as dark.
+      checkpointSeconds: How often (simulated seconds) to note the state while running, for the re-runs to merge into.
+      skipQuiescent: See simulation.run_real_data.  Makes the nights nearly free.
+      nightVoltage: Capacitor voltage to start each day from.  Defaults to the panel's Vmp.  Must be below Voc, like
+          every capacitor voltage (see simulation.below_voc()).
+
+  Returns:
+      run_real_data's totals dict, plus segments (days run), mismatchedCuts (cuts where the guessed state was
+      wrong) and resimulatedSeconds (simulated time re-run to fix those up).
+  """
+
+  times, irrs = scenario
+  times = np.asarray(times, dtype=float)
+  irrs = np.asarray(irrs, dtype=float)
+  if processes is None: processes = os.cpu_count()
+  if nightVoltage is None: nightVoltage = solarPanel.Vmp
+  checkpointSteps = max(1, int(round(checkpointSeconds / dt)))
+
+  bounds = [times[0]] + find_resets(times, irrs, dt, minDark, darkIrr) + [times[-1] + dt / 2]
+  starts = [simulation.load_snapshot(load)] + [(nightVoltage, 0, 'curtailed', 0, 0)] * (len(bounds) - 2)
+
+  tasks = []
+  for k in range(len(bounds) - 1):
+    first = max(int(np.searchsorted(times, bounds[k], side="right")) - 1, 0)
+    last = int(np.searchsorted(times, bounds[k + 1], side="left"))
+    dayLoad = copy.deepcopy(load)
+    simulation.restore_snapshot(dayLoad, starts[k])
+    # A day ends half a step before the next cut, so it takes every step before the cut and none after
+    end = bounds[k + 1] if k == len(bounds) - 2 else bounds[k + 1] - dt / 2
+    tasks.append((solarPanel, dayLoad, times[first:last], irrs[first:last], dt, bounds[k], end, checkpointSteps, skipQuiescent))
+
+  def run_all(taskList):
+    if processes == 1 or len(taskList) < 2:
+      return [run_segment(*task) for task in taskList]
+    with ProcessPoolExecutor(max_workers=min(processes, len(taskList))) as pool:
+      return list(pool.map(run_segment, *zip(*taskList)))
+
+  def restarted(k, snapshot):
+    # Day k again, from the given state, stopping once it's back in step with the first attempt
+    task = list(tasks[k])
+    task[1] = copy.deepcopy(load)
+    simulation.restore_snapshot(task[1], snapshot)
+    return tuple(task) + (results[k][0],)
+
+  results = run_all(tasks)
+  firstEnds = [checkpoints[-1][0] for checkpoints, mergedAt in results]
+
+  # Second round, also side by side: re-run every day whose guessed start was wrong, from where the first attempt
+  # at the day before ended.  That's the right start whenever the day before comes out the same as its first attempt,
+  # which it does unless it too had a wrong start that never merged.
+  redo = [k for k in range(1, len(tasks)) if not simulation.same_snapshot(firstEnds[k - 1], starts[k], 0)]
+  redone = dict(zip(redo, run_all([restarted(k, firstEnds[k - 1]) for k in redo])))
+
+  # Walk the cuts in order, checking the state each day started from against where the day before really ended
+  finals = []
+  mismatched = 0
+  resimulatedSteps = 0
+  for k in range(len(tasks)):
+    firstAttempt = results[k][0]
+    actualStart = finals[k - 1][0] if k else starts[0]
+    if simulation.same_snapshot(actualStart, starts[k], 0):
+      finals.append(firstAttempt[-1])
+      continue
+    mismatched = mismatched + 1
+    if k in redone and simulation.same_snapshot(actualStart, firstEnds[k - 1], 0):
+      checkpoints, mergedAt = redone[k]
+    else:
+      checkpoints, mergedAt = run_segment(*restarted(k, actualStart))
+    resimulatedSteps = resimulatedSteps + checkpoints[-1][1]['steps'] + checkpoints[-1][1]['skippedSteps']
+    if mergedAt is None:
+      finals.append(checkpoints[-1])
+    else:
+      # Same state from here on, so the rest of the first attempt stands
+      rest = sub_totals(firstAttempt[-1][1], firstAttempt[mergedAt][1])
+      finals.append((firstAttempt[-1][0], add_totals(checkpoints[mergedAt][1], rest)))
+
+  totals = dict.fromkeys(totalKeys, 0)
+  for snapshot, dayTotals in finals:
+    totals = add_totals(totals, dayTotals)
+  simulation.restore_snapshot(load, finals[-1][0])
+  totals['simulatedSeconds'] = float((totals['steps'] + totals['skippedSteps']) * dt)
+  totals['segments'] = len(tasks)
+  totals['mismatchedCuts'] = mismatched
+  totals['resimulatedSeconds'] = float(resimulatedSteps * dt)
+  return totals
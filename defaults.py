@@ -0,0 +1,23 @@
+import dynamicLoad
+import panel
+
+
+# The panel and load sim.py simulates: Ben's small 100W panel and a Bitaxe.  Everything else that needs them
+# (benchmark.py, the sweeps, cloudScenario.py, controllerService.py, regression.py) takes them from here.
+defaultPanelParameters = {'Voc': 21.6, 'Vmp': 18.0, 'Isc': 220.32, 'Imp': 201.6, 'maxPower': 3600.0}
+
+# Every dynamicLoad argument but initialPanelVoltage, which depends on the panel (make_load() uses its Vmp).
+# Anything a sweep parameter set leaves out comes from here.
+defaultLoadParameters = {'minVoltage': 11, 'pwrScaleUpSpeed': 5, 'pwrScaleDownSpeed': 5, 'curtailDelay': 1, 'bootDelay': 10,
+                         'maxPower': 3000, 'minPower': 180, 'capacitorSize': 180, 'targetDecrement': 0.9}
+
+
+def make_panel():
+  return panel.panel(**defaultPanelParameters)
+
+
+def make_load(solarPanel, **parameters):
+  # The default load starting at the panel's Vmp, with any of its arguments overridden
+  settings = dict(defaultLoadParameters, initialPanelVoltage=solarPanel.Vmp)
+  settings.update(parameters)
+  return dynamicLoad.dynamicLoad(**settings)
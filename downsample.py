@@ -0,0 +1,59 @@
+import numpy as np
+
+
+def visible_slice(x, xRange=None):
+  """
+  Finds the part of a sorted x array that falls inside a plot's visible range.
+
+  Args:
+      x: Sorted, numeric x values.
+      xRange: (low, high), or None for everything.
+
+  Returns:
+      (start, stop) indices.  One point either side of the range is included, so lines run off the edges of the plot.
+  """
+
+  if xRange is None:
+    return 0, len(x)
+  start = max(int(np.searchsorted(x, xRange[0], side="left")) - 1, 0)
+  stop = min(int(np.searchsorted(x, xRange[1], side="right")) + 1, len(x))
+  return start, stop
+
+
+def minmax_indices(x, y, buckets, xRange=None):
+  """
+  Picks which points of a long trace to send to the browser: the visible range is cut into buckets of equal
+  x width (about one per pixel) and only the lowest and highest point of each bucket is kept, along with
+  the first and last visible points.  Spikes and dips survive, unlike with plain decimation.
+
+  Args:
+      x: Sorted, numeric x values (e.g. seconds, or datetimes as int64 nanoseconds).
+      y: y values.  NaNs are ignored.
+      buckets: How many buckets to cut the visible range into, e.g. the plot width in pixels.
+      xRange: (low, high) visible range, or None for everything.
+
+  Returns:
+      Sorted indices into x and y.  At most 2 * buckets + 2 of them, or every visible point if there are fewer than that.
+  """
+
+  x = np.asarray(x)
+  y = np.asarray(y, dtype=float)
+  start, stop = visible_slice(x, xRange)
+  if stop - start <= 2 * buckets + 2:
+    return np.arange(start, stop)
+
+  xs = x[start:stop]
+  ys = y[start:stop]
+  edges = np.linspace(float(xs[0]), float(xs[-1]), buckets + 1)
+  starts = np.unique(np.searchsorted(xs, edges[:-1], side="left"))   # Empty buckets collapse away
+  starts = starts[starts < len(xs)]
+  counts = np.diff(np.append(starts, len(xs)))
+  bucket = np.repeat(np.arange(len(starts)), counts)
+
+  picks = [np.array([0, len(xs) - 1])]
+  for reduce in (np.fmin, np.fmax):
+    extreme = reduce.reduceat(ys, starts)
+    hits = np.flatnonzero(ys == extreme[bucket])
+    firstHit = np.unique(bucket[hits], return_index=True)[1]   # First point in each bucket that hits its min / max
+    picks.append(hits[firstHit])
+  return start + np.unique(np.concatenate(picks))
@@ -51,11 +51,12 @@ class dynamicLoad:
         #avgPanelCurrent = self.capacitorSize * dV / dt
         avgPanelCurrent = self.capacitorSize * dV / dt + self.lastPower/panelVoltage
         #irr = solarPanel.get_irradiance(avgPanelCurrent, (self.lastPanelVoltage+panelVoltage)/2)  #returns an estimate for the panel irradiance.  Max is 1000 W/m^2
-        irr = solarPanel.get_irradiance(avgPanelCurrent, panelVoltage)  #returns an estimate for the panel irradiance.  Max is 1000 W/m^2
-        irr = solarPanel.get_irradiance(avgPanelCurrent, self.lastPanelVoltage)
-        
+        #irr = solarPanel.get_irradiance(avgPanelCurrent, panelVoltage)  #returns an estimate for the panel irradiance.  Max is 1000 W/m^2
+        irr = solarPanel.get_irradiance(avgPanelCurrent, self.lastPanelVoltage)  #returns an estimate for the panel irradiance.  Max is 1000 W/m^2
+
         #Calculate the max power available, if panel was at MPP, given current irradiance:
-        powerAvailable = solarPanel.Vmp * solarPanel.panel_output(solarPanel.Vmp, irr)
+        #powerAvailable = solarPanel.Vmp * solarPanel.panel_output(solarPanel.Vmp, irr)
+        powerAvailable = solarPanel.mpp_power(irr)  # same thing, from the cached MPP current
         #print("power available = " + str(powerAvailable) + "  /  irr = " + str(irr) + " / avgI = " + str(avgPanelCurrent) + " / avgPanelPower = " + str(avgPanelPower) + " | capPower = " + str(capPower))
         #print("             capAmps " + str(capAmps) + " | capPower " + str(capPower))
 
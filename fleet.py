@@ -0,0 +1,153 @@
+import numpy as np
+
+import dynamicLoad
+import simulation
+
+
+# Integer state codes, same numbers stress_test logs.  stateNames turns a code back into the dynamicLoad string.
+RUNNING = 3
+CURTAILING = 2
+BOOTING = 1
+CURTAILED = 0
+CRASHED = -5
+stateNames = {RUNNING: 'running', CURTAILING: 'curtailing', BOOTING: 'booting', CURTAILED: 'curtailed', CRASHED: 'crashed'}
+stateCodes = {name: code for code, name in stateNames.items()}
+
+
+class fleet:
+    # N dynamicLoads, each behind its own panel and capacitor, stepped together with numpy.
+    # Everything dynamicLoad keeps per object is an array here, one entry per unit, and the state is an integer code
+    # instead of a string.  get_power() does exactly what dynamicLoad.get_power() does, unit by unit.
+    #
+    # Every load parameter can be a scalar (same for all units) or an array of length n.
+    # solarPanel is a panel.panel; give it numpy arrays for Voc/Vmp/Isc/Imp/maxPower to have a different panel per unit.
+
+    def __init__(self, solarPanel, minVoltage, pwrScaleUpSpeed, pwrScaleDownSpeed, curtailDelay, bootDelay, maxPower, minPower, capacitorSize, initialPanelVoltage, targetDecrement, n=None):
+        params = [minVoltage, pwrScaleUpSpeed, pwrScaleDownSpeed, curtailDelay, bootDelay, maxPower, minPower, capacitorSize, initialPanelVoltage, targetDecrement]
+        if n is None:
+            n = max(np.size(p) for p in params + [solarPanel.Vmp])
+        self.n = n
+        unit = lambda x: np.array(np.broadcast_to(np.asarray(x, dtype=float), (n,)))
+
+        self.solarPanel = solarPanel
+        #system constants
+        self.minVoltage = unit(minVoltage)
+        self.pwrScaleUpSpeed = unit(pwrScaleUpSpeed)
+        self.pwrScaleDownSpeed = unit(pwrScaleDownSpeed)
+        self.curtailDelay = unit(curtailDelay)
+        self.bootDelay = unit(bootDelay)
+        self.maxPower = unit(maxPower)
+        self.minPower = unit(minPower)
+        self.capacitorSize = unit(capacitorSize)
+        self.targetDecrement = unit(targetDecrement)
+        #per unit state.  ALL of these are updated each time "get_power()" is called
+        self.target = self.maxPower.copy()
+        self.state = np.full(n, RUNNING, dtype=np.int8)
+        self.curtailTime = np.zeros(n)
+        self.bootTime = np.zeros(n)
+        self.lastPanelVoltage = unit(initialPanelVoltage)
+        self.lastPower = self.target.copy()
+        self.brownouts = np.zeros(n, dtype=np.int64)   # brownouts per unit, counted by step()
+
+    @classmethod
+    def from_loads(cls, solarPanel, loads):
+        # Builds a fleet from existing dynamicLoad objects, picking up their current state as well as their settings.
+        new = cls(solarPanel,
+                  minVoltage=[l.minVoltage for l in loads], pwrScaleUpSpeed=[l.pwrScaleUpSpeed for l in loads],
+                  pwrScaleDownSpeed=[l.pwrScaleDownSpeed for l in loads], curtailDelay=[l.curtailDelay for l in loads],
+                  bootDelay=[l.bootDelay for l in loads], maxPower=[l.maxPower for l in loads], minPower=[l.minPower for l in loads],
+                  capacitorSize=[l.capacitorSize for l in loads], initialPanelVoltage=[l.lastPanelVoltage for l in loads],
+                  targetDecrement=[l.targetDecrement for l in loads], n=len(loads))
+        new.target = np.array([l.target for l in loads], dtype=float)
+        new.state = np.array([stateCodes[l.state] for l in loads], dtype=np.int8)
+        new.curtailTime = np.array([l.curtailTime for l in loads], dtype=float)
+        new.bootTime = np.array([l.bootTime for l in loads], dtype=float)
+        new.lastPower = np.array([l.lastPower for l in loads], dtype=float)
+        return new
+
+    def load(self, i):
+        # Unit i as a stand-alone dynamicLoad, e.g. to check it against the scalar code or keep simulating it alone
+        single = dynamicLoad.dynamicLoad(self.minVoltage[i], self.pwrScaleUpSpeed[i], self.pwrScaleDownSpeed[i], self.curtailDelay[i], self.bootDelay[i],
+                                         self.maxPower[i], self.minPower[i], self.capacitorSize[i], self.lastPanelVoltage[i], self.targetDecrement[i])
+        single.target = self.target[i]
+        single.state = stateNames[int(self.state[i])]
+        single.curtailTime = self.curtailTime[i]
+        single.bootTime = self.bootTime[i]
+        single.lastPower = self.lastPower[i]
+        return single
+
+    def brownout(self, mask):
+        self.state[mask] = CRASHED
+        self.lastPower[mask] = 0
+
+    def get_power(self, panelVoltage, dt):
+        # Vectorized dynamicLoad.get_power() for every unit at once.  panelVoltage is an array of length n.
+        solarPanel = self.solarPanel
+        dV = panelVoltage - self.lastPanelVoltage
+
+        #Calculate panel irradiance based on its power output and panel voltage
+        avgPanelCurrent = self.capacitorSize * dV / dt + self.lastPower/panelVoltage
+        irr = solarPanel.get_irradiance_array(avgPanelCurrent, self.lastPanelVoltage)
+
+        #Calculate the max power available, if panel was at MPP, given current irradiance:
+        powerAvailable = solarPanel.Vmp * solarPanel.panel_output_array(solarPanel.Vmp, irr)
+
+        #Update target power to equal the incoming panel power, adjusted for buffer decrement.
+        self.target = np.minimum(powerAvailable * self.targetDecrement, self.maxPower)
+
+        # State machine logic.  Masks are taken from the state on the way in, so each unit goes through exactly one branch
+        curtailing = self.state == CURTAILING
+        booting = self.state == BOOTING
+        sleeping = (self.state == CURTAILED) | (self.state == CRASHED)
+        running = self.state == RUNNING
+
+        # Curtailing: wait out the curtail delay, then drop to standby
+        self.curtailTime[curtailing] = self.curtailTime[curtailing] + dt
+        done = curtailing & (self.curtailTime >= self.curtailDelay)
+        self.curtailTime[done] = 0
+        self.state[done] = CURTAILED
+        self.lastPower[done] = 0
+
+        # Booting: wait out the boot delay, then start the ASIC at min power
+        self.bootTime[booting] = self.bootTime[booting] + dt
+        done = booting & (self.bootTime >= self.bootDelay)
+        self.bootTime[done] = 0
+        self.state[done] = RUNNING
+        self.lastPower[done] = self.minPower[done]
+
+        # Curtailed or crashed: boot once there's enough power and the capacitor has pushed the panel past Vmp
+        wake = sleeping & (self.target > self.minPower) & (panelVoltage > solarPanel.Vmp)
+        self.state[wake] = BOOTING
+        self.bootTime[wake] = 0
+        self.lastPower[sleeping] = 0
+
+        # Running: curtail if we can't run slow enough, and ramp power toward the target either way
+        curtail = running & (self.target < self.minPower)
+        self.state[curtail] = CURTAILING
+        self.curtailTime[curtail] = 0
+        down = self.target <= self.lastPower
+        newPower = np.where(down, self.lastPower - self.pwrScaleDownSpeed * dt, self.lastPower + self.pwrScaleUpSpeed * dt)
+        self.lastPower = np.where(running, newPower, self.lastPower)
+
+        # Reset all the "last recent value of X" numbers
+        self.lastPanelVoltage = panelVoltage
+        return self.lastPower.copy()   # A copy, since the next call updates lastPower in place
+
+    def step(self, irr, dt):
+        # Runs every unit forward one time step, the same way simulation.stress_test does for a single load:
+        # capacitor update, brownout check, then get_power().  irr is a scalar or an array of length n.
+        # Returns (voltage, panelPower, power) arrays, panelPower being at the end of the step.
+        solarPanel = self.solarPanel
+        v0 = self.lastPanelVoltage
+        loadPower = self.lastPower
+
+        voltage = simulation.capacitor_step_array(solarPanel, self.capacitorSize, v0, loadPower, irr, dt)
+        panelPower = solarPanel.panel_output_array(voltage, irr) * voltage
+
+        brown = voltage <= self.minVoltage
+        self.brownouts = self.brownouts + (brown & (self.state != CRASHED))
+        self.brownout(brown)
+        voltage = np.where(brown, self.minVoltage, voltage)
+
+        power = self.get_power(voltage, dt)
+        return voltage, panelPower, power
@@ -0,0 +1,87 @@
+import json
+import math
+from collections import Counter
+
+
+class profiler:
+    # Optional instrumentation for the simulation loops.  Pass one in as profile=... to stress_test() or
+    # run_real_data() and it collects:
+    #   - how many passes of the refinement loop every capacitor_step() took
+    #   - a histogram of wall time per step, on log-spaced bins, so memory doesn't grow with the run
+    #   - every dynamicLoad state change, with its simulation time
+    # The loops only touch it behind an "if profile is not None", so leaving profile=None costs next to nothing
+    # and it can stay wired in for big sweeps.  Call report() or dump() once the run is over.
+
+    binsPerDecade = 4
+    fastestBin = -7   # 10^-7 s.  Anything quicker lands in the first bin, anything slower than 10^5 s in the last
+
+    def __init__(self):
+        self.steps = 0
+        self.wallSeconds = 0.0
+        self.stepTimeCounts = [0] * (12 * self.binsPerDecade)
+        self.iterationCounts = Counter()   # passes per step -> number of steps
+        self.maxIterations = 0
+        self.maxIterationsTime = None      # simulation time of the (first) step that needed the most passes
+        self.lastIterations = 0            # passes reported for the step in progress
+        self.transitionTimes = []
+        self.transitionFrom = []
+        self.transitionTo = []
+
+    def iterations(self, count):
+        # Called by capacitor_step() with how many passes the current step needed
+        self.iterationCounts[count] = self.iterationCounts[count] + 1
+        self.lastIterations = count
+
+    def step(self, t, wallSeconds, lastState, state):
+        # Called once per simulation step, after the load has updated.  t is the simulation time at the end of the step.
+        self.steps = self.steps + 1
+        self.wallSeconds = self.wallSeconds + wallSeconds
+        b = int((math.log10(wallSeconds) - self.fastestBin) * self.binsPerDecade) if wallSeconds > 0 else 0
+        self.stepTimeCounts[min(max(b, 0), len(self.stepTimeCounts) - 1)] += 1
+        if self.lastIterations > self.maxIterations:
+            self.maxIterations = self.lastIterations
+            self.maxIterationsTime = float(t)
+        self.lastIterations = 0
+        if state != lastState:
+            self.transitionTimes.append(float(t))
+            self.transitionFrom.append(lastState)
+            self.transitionTo.append(state)
+
+    def transitions(self):
+        # The state change log as (time, from, to) tuples
+        return list(zip(self.transitionTimes, self.transitionFrom, self.transitionTo))
+
+    def summary(self):
+        edges = [10 ** (self.fastestBin + k / self.binsPerDecade) for k in range(len(self.stepTimeCounts) + 1)]
+        used = [k for k, c in enumerate(self.stepTimeCounts) if c]
+        lo, hi = (used[0], used[-1] + 1) if used else (0, 0)   # Trim the empty bins off both ends
+        pairs = Counter(zip(self.transitionFrom, self.transitionTo))
+        return {
+            'steps': self.steps,
+            'wallSeconds': self.wallSeconds,
+            'meanStepSeconds': self.wallSeconds / self.steps if self.steps else None,
+            'stepTimeHistogram': {'edges': edges[lo:hi + 1], 'counts': self.stepTimeCounts[lo:hi]},
+            'iterationCounts': {str(k): v for k, v in sorted(self.iterationCounts.items())},
+            'maxIterations': self.maxIterations,
+            'maxIterationsTime': self.maxIterationsTime,
+            'transitionCounts': {a + '->' + b: c for (a, b), c in sorted(pairs.items())},
+            'transitions': [[t, a, b] for t, a, b in self.transitions()],
+        }
+
+    def dump(self, path):
+        # summary() as JSON
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def report(self):
+        # A short human readable profile of the run
+        s = self.summary()
+        lines = ["%d steps, %.3f s wall, %.2f us/step" % (s['steps'], s['wallSeconds'], 1e6 * (s['meanStepSeconds'] or 0))]
+        lines.append("passes per step: " + ", ".join(k + ": " + str(v) for k, v in s['iterationCounts'].items())
+                     + "  (most: " + str(s['maxIterations']) + " at t=" + str(s['maxIterationsTime']) + ")")
+        lines.append("wall time per step:")
+        edges = s['stepTimeHistogram']['edges']
+        for k, c in enumerate(s['stepTimeHistogram']['counts']):
+            if c: lines.append("  %9.2e - %9.2e s  %d" % (edges[k], edges[k + 1], c))
+        lines.append("state changes: " + ", ".join(k + " x" + str(v) for k, v in s['transitionCounts'].items()))
+        return "\n".join(lines)
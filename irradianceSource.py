@@ -0,0 +1,68 @@
+import numpy as np
+
+class irradianceSource:
+    # Fast "what was the irradiance at time t" lookups over processed solar data.
+    # Build it once from the DataFrame returned by process_solar_data(), then query it as often as you like.
+    # Each scalar query is O(1) when the times only move forward (a moving cursor, which is what a simulation does)
+    # and O(log n) otherwise (binary search).  Whole arrays of query times are answered in one vectorized pass.
+    # Answers are the same as get_irr_at_time(): the value of the last sample at or before t.
+    #
+    # valueColumn can also be a list of columns, e.g. the entity columns from solarData.process_solar_entities().
+    # Then it's a multi-channel source: every answer has one value per channel, in that order, so an east and a
+    # west array can each drive their own panel (or fleet unit) from the same lookup.
+
+    def __init__(self, df, timeColumn="time_delta_seconds", valueColumn="state"):
+        times = df[timeColumn].to_numpy(dtype=float)
+        values = df[valueColumn].to_numpy(dtype=float)
+        self.channels = list(valueColumn) if isinstance(valueColumn, (list, tuple)) else None
+
+        # Sort by time.  Stable, so for duplicate timestamps the row that came first in the file stays first,
+        # which is the row get_irr_at_time() picks (idxmax returns the first occurrence)
+        order = np.argsort(times, kind="stable")
+        times = times[order]
+        values = values[order]
+
+        # Collapse duplicate timestamps down to their first row, so a binary search lands on the right sample
+        self.times, firstRows = np.unique(times, return_index=True)
+        self.values = values[firstRows]
+        if len(self.times) == 0:
+            raise ValueError("irradianceSource needs at least one sample")
+
+        self.start = self.times[0]   # first sample time, in seconds
+        self.end = self.times[-1]    # last sample time, in seconds
+        self.cursor = 0              # index of the sample the last scalar query landed on
+
+    def __len__(self):
+        return len(self.times)
+
+    def irr_at(self, t):
+        # Scalar lookup.  Walks the cursor forward from the last answer, which is nearly free when t only increases.
+        if t < self.start:
+            raise ValueError("time " + str(t) + " is before the first sample (" + str(self.start) + ")")
+        if t < self.times[self.cursor]:
+            # Went backwards in time, so fall back to a binary search
+            self.cursor = int(np.searchsorted(self.times, t, side="right")) - 1
+            return self.values[self.cursor]
+
+        last = len(self.times) - 1
+        steps = 0
+        while self.cursor < last and self.times[self.cursor + 1] <= t:
+            self.cursor = self.cursor + 1
+            steps = steps + 1
+            if steps > 32:  # Big jump forward, binary search is cheaper than walking
+                self.cursor = int(np.searchsorted(self.times, t, side="right")) - 1
+                break
+        return self.values[self.cursor]
+
+    def irr_at_times(self, t):
+        # Vectorized lookup for a whole array of query times (any order).  Returns an array of the same shape,
+        # plus a trailing channel axis for a multi-channel source.
+        t = np.asarray(t, dtype=float)
+        if t.size and t.min() < self.start:
+            raise ValueError("query times start before the first sample (" + str(self.start) + ")")
+        idx = np.searchsorted(self.times, t, side="right") - 1
+        return self.values[idx]
+
+    def reset(self):
+        # Put the cursor back to the start, e.g. before replaying the data again from t=0
+        self.cursor = 0
@@ -1,7 +1,8 @@
 import math
+import numpy as np
 
 class panel:
-    def __init__(self, Voc, Vmp, Isc, Imp, maxPower):
+    def __init__(self, Voc, Vmp, Isc, Imp, maxPower, lutTolerance=None):
         self.Voc = Voc
         self.Vmp = Vmp
         self.Isc = Isc
@@ -12,12 +13,65 @@ class panel:
         #eta = (1.0/0.11175) * (Isc/Imp) * (Voc/Vmp - 1.0)  # First estimate for Eta (greek letter)
         self.eta = (Isc/Imp) * (Isc / (Isc-Imp)) * ((Voc-Vmp)/Voc)  # Second estimate for Eta (different method)
 
+        # Current at the MPP at full sun.  Irradiance scaling is linear, so MPP power at any irradiance is just this scaled (see mpp_power)
+        self.mppCurrent = self.Imp
+
+        # Optional lookup table of the 1000 W/m^2 curve.  With lutTolerance set (in amps), panel_output() and panel_output_array()
+        # interpolate from a dense voltage grid instead of evaluating the fractional powers, and stay within lutTolerance of the analytic curve.
+        self.lutTolerance = lutTolerance
+        self.lutAmps = None
+        if lutTolerance is not None:
+            self.build_lut(lutTolerance)
+
+    def build_lut(self, tolerance, maxPoints=2**22):
+        # Tabulates the 1000 W/m^2 curve from 0 to Voc, refining the grid until linear interpolation is within tolerance (amps)
+        # everywhere it was checked, or raising a ValueError if maxPoints isn't enough.  The grid is uniform on each side of Vmp with points exactly on 0, Vmp and Voc,
+        # so the corner where the two halves of the model meet and the drop to zero at Voc are both captured exactly.
+        self.lutAmps = None   # so panel_output_array() below evaluates the real model
+        points = 256
+        while True:
+            grid = np.concatenate([np.linspace(0, self.Vmp, points + 1), np.linspace(self.Vmp, self.Voc, points + 1)[1:]])
+            amps = self.panel_output_array(grid, 1000)
+            # Check between every pair of grid points, against the analytic model
+            checks = (grid[:-1, None] + np.diff(grid)[:, None] * np.array([0.25, 0.5, 0.75])).ravel()
+            exact = self.panel_output_array(checks, 1000)
+            error = float(np.max(np.abs(np.interp(checks, grid, amps) - exact)))
+            if error <= tolerance or len(grid) * 2 > maxPoints:
+                break
+            points = points * 2
+        if error > tolerance:
+            # Ran out of points before getting there.  A table that misses its bound silently is worse than none
+            raise ValueError("panel lookup table can't get within " + str(tolerance) + " A in " + str(maxPoints)
+                             + " points, best was " + str(error) + " A; use a looser lutTolerance")
+        self.lutPoints = points
+        self.lutScaleLeft = points / self.Vmp                # grid steps per volt, below Vmp
+        self.lutScaleRight = points / (self.Voc - self.Vmp)  # grid steps per volt, above Vmp
+        self.lutGrid = grid
+        self.lutArray = amps
+        self.lutAmps = amps.tolist()   # plain floats: indexing a list from scalar code is much cheaper than indexing numpy
+        self.lutError = error          # worst error found while checking, in amps
+
     def panel_output(self, PV, irr):
         #args:
         #PV = solar panel voltage, instantaneous.  The voltage the panel is now being driven at by the buck converter/capacitor.
         #IR = irradiance, instantaneous.  In watts / meter^2.  1000 is max blast, full solar power.
         amps = 0
 
+        if self.lutAmps is not None:
+            # Interpolate the precomputed full sun curve.  Outside 0..Voc the model gives 0 anyway
+            if PV < self.Vmp:
+                x = PV * self.lutScaleLeft
+            else:
+                x = self.lutPoints + (PV - self.Vmp) * self.lutScaleRight
+            if not (0 <= x < 2 * self.lutPoints):
+                return 0
+            k = int(x)
+            a = self.lutAmps[k]
+            amps = (irr / 1000) * (a + (x - k) * (self.lutAmps[k + 1] - a))
+            if amps < 0:
+                return 0
+            return amps
+
         #The following equations are taken from this paper:  https://oa.upm.es/43747/1/PindadoRE20016.pdf
         if(PV < self.Vmp):
             amps = self.Isc * (1 - (1 - (self.Imp/self.Isc)) * (PV/self.Vmp)**(self.Imp/(self.Isc-self.Imp)))
@@ -39,4 +93,49 @@ class panel:
         #print("maxCurrent = " + str(maxCurrent))
         if maxCurrent == 0: irr=0
         irr = I / maxCurrent * 1000
-        return irr
\ No newline at end of file
+        return irr
+
+    def mpp_power(self, irr):
+        # Power at the maximum power point for this irradiance.  Same number as Vmp * panel_output(Vmp, irr), without evaluating the model.
+        amps = (irr / 1000) * self.mppCurrent
+        if amps < 0:
+            return 0
+        return self.Vmp * amps
+
+    def panel_output_array(self, PV, irr):
+        # Array version of panel_output().  PV and irr can be scalars or numpy arrays of any shape that broadcast together,
+        # so a whole I-V curve (or a whole batch of simulation steps) is one call instead of one call per point.
+        # Same math, same clamping: NaN from the fractional power on the left side becomes 0, negative current becomes 0.
+        PV, irr = np.broadcast_arrays(np.asarray(PV, dtype=float), np.asarray(irr, dtype=float))
+
+        if self.lutAmps is not None:
+            # Same interpolation as the scalar path.  The grid is uniform on each side of Vmp, so the grid cell is
+            # found with arithmetic instead of a search
+            x = np.where(PV < self.Vmp, PV * self.lutScaleLeft, self.lutPoints + (PV - self.Vmp) * self.lutScaleRight)
+            inside = (x >= 0) & (x < 2 * self.lutPoints)
+            x = np.where(inside, x, 0)
+            k = x.astype(np.int64)
+            a = self.lutArray[k]
+            amps = (irr / 1000) * np.where(inside, a + (x - k) * (self.lutArray[k + 1] - a), 0)
+            return np.where(amps < 0, 0, amps)
+
+        # Evaluate both sides of Vmp everywhere and pick per element.  The side that isn't used can produce NaN/inf
+        # (negative bases, divide by zero at PV=0), so silence those warnings while we compute.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            leftAmps = self.Isc * (1 - (1 - (self.Imp/self.Isc)) * (PV/self.Vmp)**(self.Imp/(self.Isc-self.Imp)))
+            leftAmps = np.where(np.isnan(leftAmps), 0, leftAmps)
+            rightAmps = self.Imp * (self.Vmp/PV) * (1 - ((PV-self.Vmp) / (self.Voc-self.Vmp))**self.eta)
+        amps = np.where(PV < self.Vmp, leftAmps, rightAmps)
+
+        # Linear irradiance scaling, same as the scalar version
+        amps = (irr / 1000) * amps
+        return np.where(amps < 0, 0, amps)
+
+    def get_irradiance_array(self, I, V):
+        # Array version of get_irradiance().  I and V broadcast together.  Like the scalar version, it fails if any
+        # voltage is one the panel makes no current at (at or past Voc), since there's no irradiance to back out of that.
+        I = np.asarray(I, dtype=float)
+        maxCurrent = self.panel_output_array(V, 1000)
+        if np.any(maxCurrent == 0):
+            raise ZeroDivisionError("panel makes no current at " + str(np.broadcast_to(V, maxCurrent.shape)[maxCurrent == 0][0]) + " V, can't estimate irradiance")
+        return I / maxCurrent * 1000
\ No newline at end of file
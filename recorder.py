@@ -0,0 +1,180 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+class columnStore:
+    # Append-only table of numpy columns, one row at a time.  Rows go into fixed-size in-memory blocks.
+    # Once the table outgrows spillBytes, full blocks are written out to one raw file per column instead of
+    # being kept, so memory stays at one block no matter how long the run is.  results() then hands back
+    # read-only memory maps of those files.
+
+    def __init__(self, fields, blockRows=65536, spillBytes=256 * 2**20, spillDir=None):
+        self.fields = fields                       # list of (name, dtype)
+        self.blockRows = blockRows
+        self.spillBytes = spillBytes               # None never spills
+        self.spillDir = spillDir
+        self.ownsSpillDir = False
+        self.rowBytes = sum(np.dtype(dtype).itemsize for name, dtype in fields)
+        self.blocks = []                           # full in-memory blocks, if we haven't spilled
+        self.files = None                          # {name: open file} once we've spilled
+        self.rows = 0                              # rows in finished blocks
+        self.block = self.new_block()
+        self.n = 0                                 # rows in the current block
+
+    def new_block(self):
+        return {name: np.empty(self.blockRows, dtype=dtype) for name, dtype in self.fields}
+
+    def append(self, *values):
+        block = self.block
+        n = self.n
+        for (name, dtype), value in zip(self.fields, values):
+            block[name][n] = value
+        self.n = n + 1
+        if self.n == self.blockRows:
+            self.finish_block()
+
+    def finish_block(self):
+        full = {name: column[:self.n] for name, column in self.block.items()}
+        self.rows = self.rows + self.n
+        if self.files is None and self.spillBytes is not None and self.rows * self.rowBytes > self.spillBytes:
+            self.spill()
+        if self.files is not None:
+            for name, column in full.items():
+                self.files[name].write(column.tobytes())   # The block itself gets reused
+        else:
+            self.blocks.append(full)
+            self.block = self.new_block()
+        self.n = 0
+
+    def spill(self):
+        # Switch to disk: write out everything held so far, and send every block after this straight there
+        if self.spillDir is None:
+            self.spillDir = tempfile.mkdtemp(prefix="solarsim-")
+            self.ownsSpillDir = True
+        os.makedirs(self.spillDir, exist_ok=True)
+        self.files = {name: open(os.path.join(self.spillDir, name + ".bin"), "wb") for name, dtype in self.fields}
+        for block in self.blocks:
+            for name, column in block.items():
+                self.files[name].write(column.tobytes())
+        self.blocks = []
+
+    def __len__(self):
+        return self.rows + self.n
+
+    def results(self):
+        # Every column as one array: in memory if we never spilled, otherwise read-only memory maps
+        if self.files is not None:
+            if self.n:
+                self.finish_block()
+            columns = {}
+            for name, dtype in self.fields:
+                self.files[name].flush()
+                path = os.path.join(self.spillDir, name + ".bin")
+                columns[name] = np.memmap(path, dtype=dtype, mode="r", shape=(self.rows,)) if self.rows else np.empty(0, dtype=dtype)
+            return columns
+        return {name: np.concatenate([block[name] for block in self.blocks] + [self.block[name][:self.n]]) for name, dtype in self.fields}
+
+    def close(self):
+        # Closes and deletes the spill files (only if we made the folder ourselves).  Don't use results() after this.
+        if self.files is not None:
+            for f in self.files.values():
+                f.close()
+        if self.ownsSpillDir:
+            shutil.rmtree(self.spillDir, ignore_errors=True)
+
+
+class arrayRecorder:
+    # Keeps every step, like the arrays stress_test returns, but in compact dtypes:
+    # float64 time (float32 can't hold a year in seconds to sub-second precision), float32 signals, int8 state code.
+    # Spills to disk past spillBytes (see columnStore).
+
+    def __init__(self, blockRows=65536, spillBytes=256 * 2**20, spillDir=None):
+        self.store = columnStore([('time', np.float64), ('voltage', np.float32), ('panelPower', np.float32),
+                                  ('ASICPower', np.float32), ('ASICState', np.int8)], blockRows, spillBytes, spillDir)
+
+    def record(self, t, voltage, panelPower, ASICPower, state):
+        self.store.append(t, voltage, panelPower, ASICPower, state)
+
+    def results(self):
+        return self.store.results()
+
+    def close(self):
+        self.store.close()
+
+
+class bucketRecorder:
+    # Keeps min/max/mean of each signal per bucket of bucketSeconds of simulated time, plus the lowest and
+    # highest state code seen in the bucket.  A year at dt=0.1 s with 60 s buckets is ~525k rows instead of 315M.
+
+    signals = ('voltage', 'panelPower', 'ASICPower')
+
+    def __init__(self, bucketSeconds, blockRows=65536, spillBytes=256 * 2**20, spillDir=None):
+        self.bucketSeconds = bucketSeconds
+        fields = [('time', np.float64)]
+        for signal in self.signals:
+            fields = fields + [(signal + 'Min', np.float32), (signal + 'Max', np.float32), (signal + 'Mean', np.float32)]
+        fields = fields + [('ASICStateMin', np.int8), ('ASICStateMax', np.int8), ('steps', np.int32)]
+        self.store = columnStore(fields, blockRows, spillBytes, spillDir)
+        self.bucket = None     # index of the bucket being filled
+        self.count = 0
+
+    def record(self, t, voltage, panelPower, ASICPower, state):
+        bucket = int(t // self.bucketSeconds)
+        if bucket != self.bucket:
+            self.flush()
+            self.bucket = bucket
+            self.low = [voltage, panelPower, ASICPower]
+            self.high = [voltage, panelPower, ASICPower]
+            self.total = [0.0, 0.0, 0.0]
+            self.stateLow = state
+            self.stateHigh = state
+        values = (voltage, panelPower, ASICPower)
+        for k in range(3):
+            value = values[k]
+            if value < self.low[k]: self.low[k] = value
+            if value > self.high[k]: self.high[k] = value
+            self.total[k] = self.total[k] + value
+        if state < self.stateLow: self.stateLow = state
+        if state > self.stateHigh: self.stateHigh = state
+        self.count = self.count + 1
+
+    def flush(self):
+        if self.count == 0:
+            return
+        row = [self.bucket * self.bucketSeconds]
+        for k in range(3):
+            row = row + [self.low[k], self.high[k], self.total[k] / self.count]
+        self.store.append(*(row + [self.stateLow, self.stateHigh, self.count]))
+        self.count = 0
+
+    def results(self):
+        # The bucket still being filled is included, so call this once the run is over
+        self.flush()
+        return self.store.results()
+
+    def close(self):
+        self.store.close()
+
+
+class eventRecorder:
+    # Only keeps the steps where the load changes state (plus the very first one), which is all that's needed
+    # to count and time brownouts, curtails and boots over a long run.
+
+    def __init__(self, blockRows=4096, spillBytes=256 * 2**20, spillDir=None):
+        self.store = columnStore([('time', np.float64), ('voltage', np.float32), ('ASICPower', np.float32), ('ASICState', np.int8)],
+                                 blockRows, spillBytes, spillDir)
+        self.lastState = None
+
+    def record(self, t, voltage, panelPower, ASICPower, state):
+        if state != self.lastState:
+            self.store.append(t, voltage, ASICPower, state)
+            self.lastState = state
+
+    def results(self):
+        return self.store.results()
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,125 @@
+import argparse
+import json
+import sys
+
+import numpy as np
+
+import daySplit
+import fleet
+import simulation
+import sweep
+from defaults import make_panel, make_load
+
+
+# Checks that each fast path still gives the answers of the plain scalar loop it replaces.  Run it after touching
+# any of them:  python regression.py  (exits non-zero if anything disagrees).
+# Counts (steps simulated, brownouts, curtails, time curtailed, states) have to match exactly; energies and
+# voltages can differ by float rounding only, since the fast paths add things up in a different order.
+relTol = 1e-9
+
+# Totals every fast path has to reproduce.  How many steps were computed along the way is up to the fast path
+checkedTotals = ('simulatedSeconds', 'energyHarvested', 'energyMined', 'brownouts', 'curtails', 'timeCurtailed')
+
+
+def compare_totals(name, expected, actual, keys):
+  # One check result from two run_real_data style totals dicts
+  mismatches = {}
+  for key in keys:
+    a, b = expected[key], actual[key]
+    same = np.isclose(a, b, rtol=relTol, atol=0) if isinstance(a, float) and key.startswith('energy') else a == b
+    if not same: mismatches[key] = [a, b]
+  return {'name': name, 'passed': not mismatches, 'mismatches': mismatches,
+          'expected': {key: expected[key] for key in keys}}
+
+
+def check_skip_quiescent(solarPanel, scenario, dt):
+  """
+  run_real_data with skipQuiescent against a full run that computes every step.
+  """
+
+  full = simulation.run_real_data(solarPanel, make_load(solarPanel), [scenario], dt)
+  skipped = simulation.run_real_data(solarPanel, make_load(solarPanel), [scenario], dt, skipQuiescent=True)
+  result = compare_totals("skipQuiescent vs full run", full, skipped, checkedTotals)
+  result['skippedFraction'] = skipped['skippedSteps'] / (skipped['steps'] + skipped['skippedSteps'])
+  return result
+
+
+def check_fleet(solarPanel, scenario, dt, seconds):
+  """
+  fleet.step for a small grid of load settings against one scalar capacitor_step + load_step loop per unit,
+  step by step, for seconds from the first daylight reading of the scenario.
+  """
+
+  times, irrs = scenario
+  start = times[np.argmax(irrs > 0)]
+  stepTimes = np.arange(start, min(start + seconds, times[-1]), dt)
+  stepIrr = irrs[np.maximum(np.searchsorted(times, stepTimes, side="right") - 1, 0)]
+  parameterSets = sweep.parameter_grid(capacitorSize=[60, 180], pwrScaleDownSpeed=[5, 50], curtailDelay=[1, 3])
+  loads = [make_load(solarPanel, **parameters) for parameters in parameterSets]
+  units = fleet.fleet.from_loads(solarPanel, loads)
+
+  voltage = [load.lastPanelVoltage for load in loads]
+  power = [load.lastPower for load in loads]
+  brownouts = np.zeros(len(loads), dtype=np.int64)
+  maxVoltageError = 0.0
+  maxPowerError = 0.0
+  stateMismatches = 0
+  for irr in stepIrr:
+    fleetVoltage, fleetPanelPower, fleetPower = units.step(irr, dt)
+    for k, load in enumerate(loads):
+      v = simulation.capacitor_step(solarPanel, load.capacitorSize, voltage[k], power[k], irr, dt)
+      voltage[k], power[k], brownedOut = simulation.load_step(solarPanel, load, v, dt)
+      brownouts[k] = brownouts[k] + brownedOut
+    maxVoltageError = max(maxVoltageError, float(np.max(np.abs(fleetVoltage - voltage) / np.abs(voltage))))
+    maxPowerError = max(maxPowerError, float(np.max(np.abs(fleetPower - power) / np.maximum(np.abs(power), 1.0))))
+    stateMismatches = stateMismatches + int(np.sum(units.state != [fleet.stateCodes[load.state] for load in loads]))
+
+  passed = maxVoltageError <= relTol and maxPowerError <= relTol and stateMismatches == 0 and np.array_equal(brownouts, units.brownouts)
+  return {'name': "fleet vs scalar get_power", 'passed': bool(passed), 'units': len(loads), 'steps': len(stepIrr),
+          'maxVoltageRelError': maxVoltageError, 'maxPowerRelError': maxPowerError, 'stateMismatches': stateMismatches,
+          'brownouts': [brownouts.tolist(), units.brownouts.tolist()]}
+
+
+def check_day_split(solarPanel, scenario, dt, processes=None):
+  """
+  daySplit.run_days (days in parallel, stitched back together) against one serial run_real_data.
+  """
+
+  serial = simulation.run_real_data(solarPanel, make_load(solarPanel), [scenario], dt, skipQuiescent=True)
+  stitched = daySplit.run_days(solarPanel, make_load(solarPanel), scenario, dt, processes=processes, skipQuiescent=True)
+  result = compare_totals("daySplit stitched vs serial", serial, stitched, checkedTotals)
+  result['segments'] = stitched['segments']
+  result['mismatchedCuts'] = stitched['mismatchedCuts']
+  return result
+
+
+def run_checks(file_path="data/West_roof.csv", dt=1.0, fleetSeconds=6 * 3600, processes=None):
+  """
+  Runs every check on one recorded irradiance history.
+
+  Returns:
+      A list of check results, dicts with at least 'name' and 'passed'.
+  """
+
+  solarPanel = make_panel()
+  scenario = sweep.real_data_scenario(file_path)
+  results = []
+  for check in (lambda: check_skip_quiescent(solarPanel, scenario, dt),
+                lambda: check_fleet(solarPanel, scenario, dt, fleetSeconds),
+                lambda: check_day_split(solarPanel, scenario, dt, processes)):
+    results.append(check())
+    print("%-30s %s" % (results[-1]['name'], "ok" if results[-1]['passed'] else "FAILED"), file=sys.stderr)
+  return results
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Check the fast simulation paths against the plain scalar loop.")
+  parser.add_argument("--csv", default="data/West_roof.csv", help="irradiance history to run")
+  parser.add_argument("--dt", type=float, default=1.0, help="step length in seconds")
+  parser.add_argument("--fleet-seconds", type=float, default=6 * 3600, help="simulated seconds for the fleet check")
+  parser.add_argument("--processes", type=int, help="worker processes for the daySplit check (default: every core)")
+  args = parser.parse_args()
+
+  results = run_checks(args.csv, args.dt, args.fleet_seconds, args.processes)
+  print(json.dumps(results, indent=2, default=float))
+  sys.exit(0 if all(r['passed'] for r in results) else 1)
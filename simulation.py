@@ -0,0 +1,314 @@
+from time import perf_counter
+
+import numpy as np
+
+import solarData
+
+
+# Numeric codes used when a dynamicLoad state is logged as a number
+stateCodes = {'running': 3, 'curtailing': 2, 'booting': 1, 'curtailed': 0, 'crashed': -5}
+
+
+def below_voc(solarPanel, v0, v1):
+  """
+  Keeps a step's end voltage below Voc.  The panel makes no current at Voc, so it can only ever charge the capacitor
+  toward it, never up to or past it.  A coarse step that lands at or past Voc has overshot, so it's cut back to
+  halfway between where it started and Voc instead.  (At or past Voc the load couldn't read the irradiance back off
+  the panel either: panel.get_irradiance() fails there.)
+
+  Args:
+      solarPanel: The panel feeding the capacitor.
+      v0: Voltage at the start of the step.  Scalars or numpy arrays.
+      v1: Voltage the step ended at.
+
+  Returns:
+      v1, or the cut-back voltage where v1 reached Voc.
+  """
+
+  if np.ndim(v1) == 0:
+    return v1 if v1 < solarPanel.Voc else v0 + (solarPanel.Voc - v0) / 2
+  return np.where(v1 < solarPanel.Voc, v1, v0 + (solarPanel.Voc - v0) / 2)
+
+
+def capacitor_step_array(solarPanel, capacitorSize, v0, loadPower, irr, dt):
+  """
+  capacitor_step() for arrays of capacitors at once, e.g. a whole fleet.  Every argument can be a scalar or an array,
+  as long as they broadcast together.  Gives the same voltages: the refinement loop in capacitor_step() never
+  re-evaluates the end current, so its answer is always the first corrected estimate, which is what this computes.
+
+  Returns:
+      An array of capacitor voltages at the end of the step.
+  """
+
+  i0 = solarPanel.panel_output_array(v0, irr)
+  v1 = v0 + (i0 - loadPower/v0)/capacitorSize * dt
+  i1 = solarPanel.panel_output_array(v1, irr)
+  return below_voc(solarPanel, v0, v0 + ((i0+i1)/2 - loadPower/v0)/capacitorSize * dt)
+
+
+def capacitor_step(solarPanel, capacitorSize, v0, loadPower, irr, dt, maxIterations=100, profile=None):
+  """
+  Runs the capacitor/panel voltage forward one time step.
+
+  Args:
+      solarPanel: The panel feeding the capacitor.
+      capacitorSize: Capacitance in Farads.
+      v0: Capacitor (= panel) voltage at the start of the step.
+      loadPower: Power the load draws through the whole step, in watts.
+      irr: Irradiance through the whole step, in W/m^2.
+      dt: Step length in seconds.
+      maxIterations: Cap on the refinement loop.  If it hasn't settled by then, the latest guess is used.
+      profile: Optional instrumentation.profiler, told how many passes the loop took.
+
+  Returns:
+      The capacitor voltage at the end of the step.  Always below Voc (see below_voc()).
+  """
+
+  # First guess, assuming the panel current stays at its starting value for the whole step
+  i0 = solarPanel.panel_output(v0, irr)  #starting panel current
+  v1 = v0 + (i0 - loadPower/v0)/capacitorSize * dt
+
+  # Now a small loop to more accurately calculate the integral of the power flow into the capacitor, since the above calculation is mos def wronger.
+  i1 = solarPanel.panel_output(v1, irr)  #ending panel current.
+  # The first estimate for v1 is wrong, because it assumes constant power from the panel.  So now we adjust...
+  for iteration in range(maxIterations):
+    avgI = (i0+i1)/2  #panel current
+    NEWv1 = v0 + (avgI - loadPower/v0)/capacitorSize * dt
+    if(abs(NEWv1 - v1) < 0.00001):                                     # Finally got close enough for government work, so continue
+      if profile is not None: profile.iterations(iteration + 1)
+      return below_voc(solarPanel, v0, NEWv1)
+    else:
+      v1=NEWv1   # Not close enough yet, so store the new guess as the new v1, then loop to generate a new set of averages
+  if profile is not None: profile.iterations(maxIterations)
+  return below_voc(solarPanel, v0, v1)
+
+
+def load_step(solarPanel, load, voltage, dt):
+  """
+  Lets the load react to the new capacitor voltage: brownout if it sagged too low, then one get_power() update.
+
+  Args:
+      solarPanel: The panel feeding the capacitor.
+      load: The dynamicLoad being simulated.  Its state is updated in place.
+      voltage: Capacitor voltage at the end of the step.
+      dt: Step length in seconds.
+
+  Returns:
+      A (voltage, power, brownedOut) tuple.  voltage is clamped to minVoltage on a brownout.
+  """
+
+  brownedOut = False
+  if(voltage <= load.minVoltage):
+    brownedOut = load.state != 'crashed'   # Only count the moment it goes down, not every step it stays down
+    load.brownout()  # If the voltage got too low, then cut power to the device and log it at a brownout.
+    voltage = load.minVoltage
+  power = load.get_power(voltage, dt, solarPanel)
+  return voltage, power, brownedOut
+
+
+def stress_test(solarPanel, Bitaxe, dt, highIRR, lowIRR, segmentTime, recorder=None, profile=None):
+  # With a recorder (see recorder.py) nothing is preallocated: every step goes to the recorder, panel power is
+  # logged at the end of each step, and the recorder's results() dict is returned instead of the five arrays.
+  # With a profile (an instrumentation.profiler) every step's refinement passes, wall time and state change is logged to it.
+  if recorder is not None:
+    return stress_test_recorded(solarPanel, Bitaxe, dt, highIRR, lowIRR, segmentTime, recorder, profile)
+
+  time = np.arange(0, 3 * segmentTime, dt)
+  voltage =  np.ones_like(time)     # Initialize voltage
+  panelPower = np.ones_like(time)
+  ASICPower = np.ones_like(time)
+  ASICState = np.ones_like(time)
+  voltage[0] = Bitaxe.lastPanelVoltage  # really the capacitor voltage, but same thing
+  panelPower[0] = voltage[0] * solarPanel.panel_output(voltage[0], highIRR)
+  ASICPower[0] = Bitaxe.lastPower      # Initialize the ASIC power
+  ASICState[0] = '3'
+  print("voltage[0] = " + str(voltage[0]) + " /  panelPower[0] = " + str(panelPower[0]))
+  for i in range(1, len(time)):        # Determine irradiance based on simulation time
+    if profile is not None:
+      stepStart = perf_counter()
+      lastState = Bitaxe.state
+    irr = 0
+    if time[i] <= segmentTime:                                          # Segment 0, stabilize at full irr, full power
+      irr = highIRR
+    elif time[i] <= segmentTime*2:                                      # Segment 1, full power loss, min irr.  Begin discharge, ASIC should cycle into sleep mode.
+      irr = lowIRR
+    else:                                                               # Segment 2, full power returns max irr, ASIC reboots, observe power ramp up.
+      irr = highIRR
+
+    # Based on the new irradiance, get the panel power output
+    panelPower[i-1] = solarPanel.panel_output(voltage[i-1], irr) * voltage[i-1]
+
+    # Use Panel output and ASIC last power setting and dt to run the sim forward one step and get the new capacitor/panel voltage
+    voltage[i] = capacitor_step(solarPanel, Bitaxe.capacitorSize, voltage[i-1], ASICPower[i-1], irr, dt, profile=profile)
+    panelPower[i] = solarPanel.panel_output(voltage[i], irr) * voltage[i]
+
+    # Now let the ASIC state machine update and calculate it's new power draw
+    voltage[i], ASICPower[i], brownedOut = load_step(solarPanel, Bitaxe, voltage[i], dt)
+    ASICState[i] = stateCodes[Bitaxe.state]
+    if profile is not None: profile.step(time[i], perf_counter() - stepStart, lastState, Bitaxe.state)
+
+  return time, voltage, panelPower, ASICPower, ASICState
+
+
+def stress_test_recorded(solarPanel, Bitaxe, dt, highIRR, lowIRR, segmentTime, recorder, profile=None):
+  # stress_test writing into a recorder instead of preallocated arrays.  Same steps, same physics.
+  voltage = Bitaxe.lastPanelVoltage
+  power = Bitaxe.lastPower
+  recorder.record(0.0, voltage, voltage * solarPanel.panel_output(voltage, highIRR), power, 3)
+  steps = int(np.ceil(3 * segmentTime / dt))
+  for i in range(1, steps):
+    if profile is not None:
+      stepStart = perf_counter()
+      lastState = Bitaxe.state
+    t = i * dt
+    irr = highIRR if t <= segmentTime or t > segmentTime*2 else lowIRR
+    voltage = capacitor_step(solarPanel, Bitaxe.capacitorSize, voltage, power, irr, dt, profile=profile)
+    panelPower = solarPanel.panel_output(voltage, irr) * voltage
+    voltage, power, brownedOut = load_step(solarPanel, Bitaxe, voltage, dt)
+    recorder.record(t, voltage, panelPower, power, stateCodes[Bitaxe.state])
+    if profile is not None: profile.step(t, perf_counter() - stepStart, lastState, Bitaxe.state)
+
+  return recorder.results()
+
+
+def load_snapshot(load):
+  # Everything that carries the load's state machine from one step to the next (target is recomputed every step)
+  return (load.lastPanelVoltage, load.lastPower, load.state, load.curtailTime, load.bootTime)
+
+
+def restore_snapshot(load, snapshot):
+  # Puts a load back into the state load_snapshot() took, e.g. to pick a run up again in another process
+  load.lastPanelVoltage, load.lastPower, load.state, load.curtailTime, load.bootTime = snapshot
+
+
+def same_snapshot(a, b, tol):
+  return a[2] == b[2] and abs(a[0] - b[0]) <= tol and abs(a[1] - b[1]) <= tol and a[3] == b[3] and a[4] == b[4]
+
+
+def run_real_data(solarPanel, load, irrChunks, dt, skipQuiescent=False, quiescentTol=0.0, maxPeriod=4, recorder=None,
+                  profile=None, until=None):
+  """
+  Runs the panel + load over a whole recorded irradiance history, e.g. weeks of Home Assistant data,
+  and adds up what happened.  Nothing is stored per step, and only one chunk of the irradiance history
+  is held at a time, so memory stays flat no matter how long the history is.
+
+  Irradiance is held at the last reading at or before each step (the sensor only logs changes), and the
+  simulation runs from the first reading to the last.
+
+  Args:
+      solarPanel: The panel feeding the capacitor.
+      load: The dynamicLoad to run.  Its state is updated in place; its lastPanelVoltage and lastPower are the starting point.
+      irrChunks: Iterable of (time_delta_seconds, irradiance) array pairs in time order,
+          e.g. solarData.stream_solar_data("data/West_roof.csv").  A ValueError is raised if the times ever go backwards.
+      dt: Step length in seconds.  Also how far past the last reading the simulation runs.
+      skipQuiescent: While the irradiance holds steady, watch for the panel + load settling into
+          a repeating pattern: completely still (a night spent curtailed, capacitor settled) or a short cycle
+          (running flat out, power ticking down and back up).  Once the last step matches the one maxPeriod or fewer
+          steps before it, jump ahead by whole cycles to just before the next irradiance change, adding that
+          cycle's energy and time for every cycle skipped.  Fine steps resume around the change.  With the default
+          quiescentTol the totals come out identical to a full run, for a fraction of the steps.
+      quiescentTol: How close (volts, watts) two steps have to be to count as a repeat.  The default 0 only skips
+          exact repeats.  Anything looser also skips slow drifts (e.g. a capacitor creeping up on Voc), and the
+          state machine is touchy enough that even 1e-12 shifts the curtail count on the bundled data.
+      maxPeriod: Longest cycle, in steps, to look for.
+      recorder: Optional recorder (see recorder.py) that gets every step, e.g. a bucketRecorder for a plot of a
+          whole season.  Steps jumped over by skipQuiescent aren't recorded; the recorder just sees time jump.
+      profile: Optional instrumentation.profiler that gets every computed step's refinement passes, wall time
+          and state change.  Skipped steps aren't profiled either.
+      until: Optional time to stop at instead of just after the last reading.  Every step that starts before
+          it is taken, whichever chunk it falls in, and nothing after it.  Used to run one window of a longer
+          history (see daySplit.py).
+
+  Returns:
+      A dict of totals: simulatedSeconds, steps (steps actually computed), skippedSteps, energyHarvested and
+      energyMined (watt-hours), brownouts, curtails (times the load started curtailing) and timeCurtailed (seconds not running).
+  """
+
+  totals = {'simulatedSeconds': 0.0, 'steps': 0, 'skippedSteps': 0, 'energyHarvested': 0.0, 'energyMined': 0.0,
+            'brownouts': 0, 'curtails': 0, 'timeCurtailed': 0.0}
+  harvestedJoules = 0.0
+  minedJoules = 0.0
+  voltage = load.lastPanelVoltage
+  power = load.lastPower
+  lastState = load.state
+  t = None
+  lastReading = -np.inf
+
+  # Look one chunk ahead, so we know where the current chunk's last reading stops applying
+  chunks = iter(irrChunks)
+  current = next(chunks, None)
+  while current is not None:
+    times, irrs = current
+    solarData.check_sorted(times, lastReading)
+    lastReading = times[-1]
+    following = next(chunks, None)
+    if t is None:
+      t = times[0]
+    if following is None:
+      stop = times[-1] + dt / 2 if until is None else until   # Last chunk: run up to (and including) the last reading
+    else:
+      stop = following[0][0]      # Run up to where the next chunk's first reading takes over
+      if until is not None: stop = min(stop, until)
+
+    # Zero-order hold lookup for every step in this chunk in one go
+    stepTimes = np.arange(t, stop, dt)
+    stepIrr = irrs[np.maximum(np.searchsorted(times, stepTimes, side="right") - 1, 0)]
+
+    if skipQuiescent:
+      # For every step, the index where its run of constant irradiance ends.  Skips never jump past one.
+      changes = np.flatnonzero(np.diff(stepIrr)) + 1
+      runEnd = np.append(changes, len(stepIrr))[np.searchsorted(changes, np.arange(len(stepIrr)), side="right")]
+      history = []   # (snapshot, harvested, mined, curtailed time, anything happened) for the latest steps
+
+    i = 0
+    while i < len(stepIrr):
+      if profile is not None: stepStart = perf_counter()
+      irr = stepIrr[i]
+      stepHarvested = solarPanel.panel_output(voltage, irr) * voltage * dt
+      stepMined = power * dt
+      harvestedJoules = harvestedJoules + stepHarvested
+      minedJoules = minedJoules + stepMined
+
+      lastState = load.state
+      voltage = capacitor_step(solarPanel, load.capacitorSize, voltage, power, irr, dt, profile=profile)
+      voltage, power, brownedOut = load_step(solarPanel, load, voltage, dt)
+
+      curtailed = load.state == 'curtailing' and lastState != 'curtailing'
+      if brownedOut: totals['brownouts'] = totals['brownouts'] + 1
+      if curtailed: totals['curtails'] = totals['curtails'] + 1
+      stepCurtailedTime = dt if load.state != 'running' else 0
+      if recorder is not None:
+        recorder.record(stepTimes[i] + dt, voltage, solarPanel.panel_output(voltage, irr) * voltage, power, stateCodes[load.state])
+      totals['timeCurtailed'] = totals['timeCurtailed'] + stepCurtailedTime
+      totals['steps'] = totals['steps'] + 1
+      if profile is not None: profile.step(stepTimes[i] + dt, perf_counter() - stepStart, lastState, load.state)
+      i = i + 1
+
+      if skipQuiescent:
+        if i == 1 or stepIrr[i-1] != stepIrr[i-2]: history = []   # New irradiance, start watching again
+        history.append((load_snapshot(load), stepHarvested, stepMined, stepCurtailedTime, brownedOut or curtailed or load.state != lastState))
+        if len(history) > maxPeriod + 1: history.pop(0)
+        for period in range(1, min(maxPeriod, len(history) - 1) + 1):
+          cycle = history[-period:]
+          if any(step[4] for step in cycle) or not same_snapshot(history[-1][0], history[-1-period][0], quiescentTol):
+            continue
+          cycles = (runEnd[i-1] - i) // period
+          if cycles > 0:
+            harvestedJoules = harvestedJoules + cycles * sum(step[1] for step in cycle)
+            minedJoules = minedJoules + cycles * sum(step[2] for step in cycle)
+            totals['timeCurtailed'] = totals['timeCurtailed'] + cycles * sum(step[3] for step in cycle)
+            totals['skippedSteps'] = totals['skippedSteps'] + int(cycles) * period
+            i = i + cycles * period
+            history = []
+          break
+
+    if len(stepTimes): t = stepTimes[-1] + dt
+    if until is not None and t >= until: break
+
+    current = following
+
+  totals['simulatedSeconds'] = float((totals['steps'] + totals['skippedSteps']) * dt)
+  totals['energyHarvested'] = float(harvestedJoules) / 3600
+  totals['energyMined'] = float(minedJoules) / 3600
+  totals['timeCurtailed'] = float(totals['timeCurtailed'])
+  return totals
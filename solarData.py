@@ -0,0 +1,294 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def process_solar_data(file_path, use_cache=False):
+  """
+  This function reads a CSV file containing solar panel power data, performs initial
+  calculations, and returns a modified DataFrame.
+
+  Args:
+      file_path: The path to the CSV file.
+      use_cache: Build the DataFrame from the binary column cache (see load_solar_columns) instead of
+          parsing the CSV every time.  The "state" column is then float32.
+
+  Returns:
+      A pandas DataFrame containing the processed data.
+  """
+
+  if use_cache:
+    columns = load_solar_columns(file_path)
+    nanoseconds = np.round(np.asarray(columns['seconds']) * 1e9).astype(np.int64)
+    return pd.DataFrame({'state': np.asarray(columns['irradiance']),
+                         'last_changed': columns['first_timestamp'] + pd.to_timedelta(nanoseconds, unit='ns'),
+                         'time_delta_seconds': np.asarray(columns['seconds'])})
+
+  # Read the CSV data into a DataFrame
+  df = pd.read_csv(file_path)
+
+  # Find the maximum value in the "state" column
+  df['state'] = pd.to_numeric(df['state'], errors='coerce')
+  max_watts = df['state'].max()
+
+  # Scale the "state" values between 0 and 1000
+  df['state'] = df['state'] / max_watts * 1000
+
+  # Convert the "last_changed" column to datetime format
+  df["last_changed"] = pd.to_datetime(df["last_changed"])
+
+  # Calculate the difference between each timestamp and the first timestamp
+  first_timestamp = df["last_changed"].min()
+  df["time_delta_seconds"] = (df["last_changed"] - first_timestamp) / pd.Timedelta(seconds=1)
+
+  # Drop the "entity_id" column
+  df = df.drop("entity_id", axis=1)
+
+  return df
+
+
+def get_irr_at_time(df, target_time):
+  """
+  This function takes a DataFrame containing processed solar panel data and a target
+  time in seconds, and returns the scaled power output closest to, but before, the target time.
+
+  Args:
+      df: The DataFrame containing the processed data.
+      target_time: The target time in seconds.
+
+  Returns:
+      The scaled power output closest to, but before, the target time.
+
+  Note:
+      This scans the whole DataFrame on every call.  For repeated lookups build an
+      irradianceSource.irradianceSource once and query that instead.
+  """
+
+  # Find the index of the timestamp closest to, but before, the target time
+  closest_index = df[df["time_delta_seconds"] <= target_time]["time_delta_seconds"].idxmax()
+
+  # Return the corresponding scaled power output
+  return df.loc[closest_index, "state"]
+
+
+def scan_solar_data(file_path, chunksize=10000):
+  """
+  Makes one cheap pass over a solar CSV to find the numbers process_solar_data() needs
+  from the whole file before it can scale anything: the max power reading and the first timestamp.
+  Only one chunk is held in memory at a time.
+
+  Args:
+      file_path: The path to the CSV file.
+      chunksize: Rows to read per chunk.
+
+  Returns:
+      A (max_watts, first_timestamp) tuple.
+  """
+
+  max_watts = np.nan
+  first_timestamp = None
+  for chunk in pd.read_csv(file_path, usecols=["state", "last_changed"], chunksize=chunksize):
+    max_watts = np.nanmax([max_watts, pd.to_numeric(chunk["state"], errors='coerce').max()])
+    chunk_first = pd.to_datetime(chunk["last_changed"]).min()
+    if first_timestamp is None or chunk_first < first_timestamp:
+      first_timestamp = chunk_first
+
+  return max_watts, first_timestamp
+
+
+def stream_solar_data(file_path, chunksize=10000, max_watts=None, first_timestamp=None):
+  """
+  Generator version of process_solar_data() for files too long to hold in memory along with a simulation.
+  Yields the same scaled irradiance and time_delta_seconds values, one chunk of rows at a time, as plain numpy arrays.
+  Rows that don't hold a number (Home Assistant writes 'unavailable') are dropped, so a simulation just holds
+  the last good reading across them.  The file must be sorted by time, which the single-sensor exports are;
+  multi-sensor exports (one block of rows per entity) aren't, and need process_solar_entities() instead.
+
+  Args:
+      file_path: The path to the CSV file.
+      chunksize: Rows to read per chunk.
+      max_watts: Power reading that scales to 1000 W/m^2.  Found with scan_solar_data() if not given.
+      first_timestamp: Timestamp that becomes t=0.  Found with scan_solar_data() if not given.
+
+  Yields:
+      (time_delta_seconds, irradiance) tuples of float64 numpy arrays.
+
+  Raises:
+      ValueError: If a timestamp is earlier than the one before it, within a chunk or across chunks.
+  """
+
+  if max_watts is None or first_timestamp is None:
+    scanned_max, scanned_first = scan_solar_data(file_path, chunksize)
+    if max_watts is None: max_watts = scanned_max
+    if first_timestamp is None: first_timestamp = scanned_first
+
+  last_seconds = -np.inf
+  for chunk in pd.read_csv(file_path, usecols=["state", "last_changed"], chunksize=chunksize):
+    state = pd.to_numeric(chunk["state"], errors='coerce')
+    good = state.notna()
+    irr = (state[good] / max_watts * 1000).to_numpy(dtype=float)
+    seconds = ((pd.to_datetime(chunk["last_changed"][good]) - first_timestamp) / pd.Timedelta(seconds=1)).to_numpy(dtype=float)
+    if len(seconds):
+      check_sorted(seconds, last_seconds, file_path)
+      last_seconds = seconds[-1]
+      yield seconds, irr
+
+
+def check_sorted(seconds, last_seconds=-np.inf, source="irradiance data"):
+  """
+  Raises a ValueError if seconds ever goes backwards, or starts before last_seconds (the end of the chunk before).
+  The chunked readers and the simulation hold each reading until the next one, so unsorted times would silently
+  give the wrong irradiance.
+  """
+
+  back = np.flatnonzero(np.diff(np.append(last_seconds, seconds)) < 0)
+  if len(back):
+    before = last_seconds if back[0] == 0 else seconds[back[0] - 1]
+    raise ValueError(str(source) + " isn't sorted by time: " + str(seconds[back[0]]) + " s comes after " + str(before)
+                     + " s.  Multi-sensor exports list each sensor in its own block; use solarData.process_solar_entities() for those")
+
+
+# Bump this whenever the cached columns change meaning, so old caches get rebuilt
+CACHE_VERSION = 1
+
+
+def file_signature(file_path, check_hash=False):
+  """
+  What a cache built from file_path has to match to still be valid: the full path, size and modification
+  time, plus a SHA-1 of the contents if check_hash is set (slower, but survives copies and touched files).
+  """
+
+  stat = os.stat(file_path)
+  signature = {'version': CACHE_VERSION, 'path': os.path.abspath(file_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+  if check_hash:
+    sha = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+      for block in iter(lambda: f.read(1 << 20), b''):
+        sha.update(block)
+    signature['sha1'] = sha.hexdigest()
+  return signature
+
+
+def build_solar_cache(file_path, cache_path, signature):
+  """
+  Parses a solar CSV once, the same way process_solar_data() does, and writes the columns to cache_path
+  as plain .npy files: float32 irradiance, float64 seconds since the first sample, and an int16 entity code.
+  meta.json is written last, so a half-written cache is never mistaken for a good one.
+  """
+
+  df = pd.read_csv(file_path)
+  state = pd.to_numeric(df['state'], errors='coerce')
+  max_watts = state.max()
+  last_changed = pd.to_datetime(df["last_changed"])
+  first_timestamp = last_changed.min()
+  entity_codes, entity_names = pd.factorize(df["entity_id"])
+
+  os.makedirs(cache_path, exist_ok=True)
+  meta_path = os.path.join(cache_path, "meta.json")
+  if os.path.exists(meta_path): os.remove(meta_path)
+  np.save(os.path.join(cache_path, "irradiance.npy"), (state / max_watts * 1000).to_numpy(dtype=np.float32))
+  np.save(os.path.join(cache_path, "seconds.npy"), ((last_changed - first_timestamp) / pd.Timedelta(seconds=1)).to_numpy(dtype=np.float64))
+  np.save(os.path.join(cache_path, "entity.npy"), entity_codes.astype(np.int16))
+
+  meta = dict(signature)
+  meta['entities'] = [str(name) for name in entity_names]
+  meta['max_watts'] = float(max_watts)
+  meta['first_timestamp'] = first_timestamp.isoformat()
+  with open(meta_path + ".tmp", 'w') as f:
+    json.dump(meta, f)
+  os.replace(meta_path + ".tmp", meta_path)
+  return meta
+
+
+def load_solar_columns(file_path, cache_dir=None, check_hash=False):
+  """
+  Loads the processed columns of a solar CSV from a binary cache, building the cache first if it's missing
+  or the CSV has changed since.  The arrays come back memory-mapped, so a warm load takes milliseconds.
+
+  Args:
+      file_path: The path to the CSV file.
+      cache_dir: Where to keep caches.  Defaults to a .solar_cache folder next to the CSV.
+      check_hash: Also key the cache on a hash of the file contents, not just its size and mtime.
+
+  Returns:
+      A dict with 'irradiance' (float32, scaled 0-1000 like process_solar_data), 'seconds' (float64, since the
+      first sample), 'entity' (int16 index into 'entities'), 'entities' (list of entity_id names),
+      'max_watts' and 'first_timestamp' (a pandas Timestamp).
+  """
+
+  if cache_dir is None:
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(file_path)), ".solar_cache")
+  abs_path = os.path.abspath(file_path)
+  cache_path = os.path.join(cache_dir, os.path.basename(file_path) + "-" + hashlib.sha1(abs_path.encode()).hexdigest()[:12])
+  signature = file_signature(file_path, check_hash)
+
+  meta = None
+  try:
+    with open(os.path.join(cache_path, "meta.json")) as f:
+      meta = json.load(f)
+  except (OSError, ValueError):
+    pass
+  if meta is None or any(meta.get(key) != value for key, value in signature.items()):
+    meta = build_solar_cache(file_path, cache_path, signature)
+
+  columns = {name: np.load(os.path.join(cache_path, name + ".npy"), mmap_mode='r') for name in ("irradiance", "seconds", "entity")}
+  columns['entities'] = meta['entities']
+  columns['max_watts'] = meta['max_watts']
+  columns['first_timestamp'] = pd.Timestamp(meta['first_timestamp'])
+  return columns
+
+
+def process_solar_entities(file_path):
+  """
+  Multi-sensor version of process_solar_data(), for exports like This_week_east_west_overlay.csv that
+  interleave several entity_ids.  Each entity is scaled to 0-1000 by its own max, then all of them are
+  lined up on one shared time grid (every timestamp any sensor logged) in a single vectorized pass.
+  Between readings each sensor holds its last value, the same as get_irr_at_time().  'unavailable' rows are
+  dropped, as in stream_solar_data(), so the sensor holds its last good reading across them; get_irr_at_time()
+  returns NaN there instead.  Before a sensor's first reading it reads 0.
+
+  Uses the column cache from load_solar_columns(), so only the first call parses the CSV.
+
+  Args:
+      file_path: The path to the CSV file.
+
+  Returns:
+      A pandas DataFrame with "last_changed", "time_delta_seconds" and one irradiance column per entity_id,
+      ready for irradianceSource.irradianceSource(df, valueColumn=[...entity ids...]).
+  """
+
+  columns = load_solar_columns(file_path)
+  seconds = np.asarray(columns['seconds'])
+  irradiance = np.asarray(columns['irradiance'], dtype=np.float64)
+  entity = np.asarray(columns['entity'], dtype=np.int64)
+  n_entities = len(columns['entities'])
+
+  # Scale each entity by its own max rather than the file-wide one
+  good = ~np.isnan(irradiance)
+  entity_max = np.zeros(n_entities)
+  np.maximum.at(entity_max, entity[good], irradiance[good])
+  scaled = irradiance / np.where(entity_max > 0, entity_max, 1)[entity] * 1000
+
+  # Shared grid of every timestamp, and which grid row each CSV row lands on
+  grid, row = np.unique(seconds, return_inverse=True)
+
+  # If a sensor logged the same timestamp twice, keep its first row, same as get_irr_at_time()
+  key = row[good] * n_entities + entity[good]
+  key, first = np.unique(key, return_index=True)
+  table = np.full((len(grid), n_entities), np.nan)
+  table[key // n_entities, key % n_entities] = scaled[good][first]
+
+  # Forward fill down each column: for every cell, find the last row at or above it that has a reading
+  has_value = ~np.isnan(table)
+  last_row = np.maximum.accumulate(np.where(has_value, np.arange(len(grid))[:, None], 0), axis=0)
+  table = table[last_row, np.arange(n_entities)]
+  table[np.isnan(table)] = 0
+
+  nanoseconds = np.round(grid * 1e9).astype(np.int64)
+  df = pd.DataFrame(table, columns=columns['entities'])
+  df.insert(0, "time_delta_seconds", grid)
+  df.insert(0, "last_changed", columns['first_timestamp'] + pd.to_timedelta(nanoseconds, unit='ns'))
+  return df
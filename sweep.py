@@ -0,0 +1,126 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import defaults
+import dynamicLoad
+import simulation
+import solarData
+
+
+# Set once in each worker process by start_worker(), so the panel and irradiance arrays aren't re-sent with every task
+workerScenario = None
+
+
+def parameter_grid(**values):
+  """
+  Builds every combination of the given parameter values.
+
+  Args:
+      **values: Lists of values, keyed by dynamicLoad argument name,
+          e.g. capacitorSize=[60, 120, 180], curtailDelay=[1, 2].
+
+  Returns:
+      A list of parameter dicts, one per combination.
+  """
+
+  names = list(values)
+  return [dict(zip(names, combo)) for combo in itertools.product(*(values[name] for name in names))]
+
+
+def stress_scenario(highIRR, lowIRR, segmentTime):
+  """
+  The stress_test high -> low -> high irradiance pattern as a (times, irradiance) scenario.
+
+  Returns:
+      A (times, irradiance) tuple of numpy arrays.
+  """
+
+  return np.array([0.0, segmentTime, segmentTime*2, segmentTime*3]), np.array([highIRR, lowIRR, highIRR, highIRR], dtype=float)
+
+
+def real_data_scenario(file_path):
+  """
+  A recorded irradiance history as a (times, irradiance) scenario, e.g. "data/West_roof.csv".
+
+  Returns:
+      A (times, irradiance) tuple of numpy arrays, with unreadable rows already dropped.
+  """
+
+  chunks = list(solarData.stream_solar_data(file_path))
+  return np.concatenate([c[0] for c in chunks]), np.concatenate([c[1] for c in chunks])
+
+
+def available_energy(solarPanel, times, irrs, end):
+  """
+  Energy the panel could have produced with perfect MPP tracking over the scenario, in watt-hours.
+  Irradiance is held between readings, same as the simulation.
+  """
+
+  mppPower = solarPanel.Vmp * solarPanel.panel_output_array(solarPanel.Vmp, irrs)
+  durations = np.diff(np.append(times, end))
+  return float(np.sum(mppPower * durations)) / 3600
+
+
+def start_worker(solarPanel, times, irrs, dt):
+  global workerScenario
+  workerScenario = (solarPanel, times, irrs, dt)
+
+
+def run_one(parameters):
+  # Runs one parameter set against the worker's scenario.  Top level, so the process pool can pickle it.
+  solarPanel, times, irrs, dt = workerScenario
+  settings = dict(defaults.defaultLoadParameters)
+  settings.update(parameters)
+  settings.setdefault('initialPanelVoltage', solarPanel.Vmp)
+  load = dynamicLoad.dynamicLoad(**settings)
+  return simulation.run_real_data(solarPanel, load, [(times, irrs)], dt)
+
+
+def run_sweep(solarPanel, parameterSets, scenario, dt, processes=None):
+  """
+  Runs many dynamicLoad configurations against the same panel and irradiance scenario, spread across a process pool.
+
+  Args:
+      solarPanel: The panel to use for every run.
+      parameterSets: List of dicts of dynamicLoad arguments, e.g. from parameter_grid().  Missing arguments
+          come from defaults.defaultLoadParameters; initialPanelVoltage defaults to the panel's Vmp.
+      scenario: A (times, irradiance) tuple, e.g. from stress_scenario() or real_data_scenario().
+      dt: Step length in seconds (see simulation.run_real_data).
+      processes: Worker processes.  Defaults to every core.  1 runs everything in this process.
+
+  Returns:
+      A pandas DataFrame with one row per parameter set: the parameters, then utilisation (energy mined /
+      energy available at MPP), energyMined, energyAvailable (watt-hours), brownouts, curtails,
+      timeCurtailed (seconds), meanASICPower (watts) and steps.
+  """
+
+  times, irrs = scenario
+  times = np.asarray(times, dtype=float)
+  irrs = np.asarray(irrs, dtype=float)
+  if processes is None: processes = os.cpu_count()
+
+  if processes == 1:
+    start_worker(solarPanel, times, irrs, dt)
+    results = [run_one(parameters) for parameters in parameterSets]
+  else:
+    with ProcessPoolExecutor(max_workers=processes, initializer=start_worker, initargs=(solarPanel, times, irrs, dt)) as pool:
+      results = list(pool.map(run_one, parameterSets, chunksize=max(1, len(parameterSets) // (processes * 4))))
+
+  energyAvailable = available_energy(solarPanel, times, irrs, times[-1] + dt / 2)
+  rows = []
+  for parameters, totals in zip(parameterSets, results):
+    row = dict(parameters)
+    row['utilisation'] = totals['energyMined'] / energyAvailable if energyAvailable > 0 else np.nan
+    row['energyMined'] = totals['energyMined']
+    row['energyAvailable'] = energyAvailable
+    row['brownouts'] = totals['brownouts']
+    row['curtails'] = totals['curtails']
+    row['timeCurtailed'] = totals['timeCurtailed']
+    row['meanASICPower'] = totals['energyMined'] * 3600 / totals['simulatedSeconds'] if totals['simulatedSeconds'] > 0 else np.nan
+    row['steps'] = totals['steps']
+    rows.append(row)
+  return pd.DataFrame(rows)